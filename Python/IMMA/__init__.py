@@ -1,6 +1,7 @@
 # Python module for handling IMMA data
 # IMMA documentation is at http://icoads.noaa.gov/e-doc/imma
 
+import gzip
 import re
 
 
@@ -15,10 +16,24 @@ class IMMA(object):
     def __setitem__(self, key, item):
         self.data[key] = item
 
+    def clear(self):
+        """
+        Remove all the data and attachments from the record
+
+        The record's existing list and dictionary are emptied rather than
+        replaced, so a record can be re-used without new allocations.
+
+        :return: None
+        """
+        del self.attachments[:]
+        self.data.clear()
+
     def read(self, line):
         """
         Read in a record from a file
 
+        Any existing data in the record are removed first.
+
         :param line: The line to decode
         :type line: str
 
@@ -26,41 +41,20 @@ class IMMA(object):
         """
         line = line.rstrip('\n')
 
-        # Core is always present (and first)
-        attachment = 0
-        length = 108
+        # Get rid of any existing data in the record
+        self.clear()
 
         # Decode each attachment
-        while len(line) > 0:
+        for attachment, start, end in attachment_spans(line):
 
             # Pad the string with blanks if it's too short
-            if length is not None and length > 0 and len(line) < length:
-                sfmt = "%%%ds" % (length - len(line))
-                line += sfmt % " "
+            as_string = line[start:end]
+            if end > len(line):
+                as_string += " " * (end - len(line))
 
-            self.decode(line, get_attachment(attachment), get_parameters(attachment), get_definitions(attachment))
+            self.decode(as_string, get_attachment(attachment), get_parameters(attachment), get_definitions(attachment))
             self.attachments.append(int(attachment))
 
-            if length is None or length == 0:
-                break
-
-            line = line[length:len(line)]
-            if len(line) > 0:
-                attachment = int(line[0:2])
-                length = line[2:4]
-
-                if re.search('\S', length) is None:
-                    length = None
-
-                if length is not None:
-                    length = int(length)
-                    if length != 0:
-                        length = int(length) - 4
-                        line = line[4:len(line)]
-
-                if get_attachment(attachment) is None:
-                    raise Exception("Bad IMMA string - Unsupported attachment ID %d" % attachment)
-
         return 1
 
     def write(self, fh):
@@ -113,27 +107,7 @@ class IMMA(object):
                 self[parameters[i]] = self[parameters[i]].rstrip("\n")
                 position = len(as_string)
 
-            # Blanks mean value is undefined
-            if re.search('\S', self[parameters[i]]) is None:
-                self[parameters[i]] = None
-                continue
-
-            if definitions[parameters[i]][6] == 2:
-                self[parameters[i]] = decode_base36(self[parameters[i]])
-
-            if definitions[parameters[i]][6] == 1:
-                if self[parameters[i]].strip() == '-' or ' ' in self[parameters[i]].strip():
-                    self[parameters[i]] = None
-                    continue
-                else:
-                    try:
-                        self[parameters[i]] = int(self[parameters[i]])
-                    except ValueError:
-                        self[parameters[i]] = None
-                        continue
-
-            if definitions[parameters[i]][5] is not None and definitions[parameters[i]][5] != 1.0:
-                self[parameters[i]] = int(self[parameters[i]]) * definitions[parameters[i]][5]
+            self[parameters[i]] = decode_value(self[parameters[i]], definitions[parameters[i]])
 
     def encode(self, attachment, parameters, definitions):
         """
@@ -159,7 +133,7 @@ class IMMA(object):
                 # Scale to integer units for output
                 if definitions[parameters[i]][5] is not None:
                     tmp /= definitions[parameters[i]][5]
-                    tmp = int(tmp + 0.5)  # nint
+                    tmp = nint(tmp)
 
                 # Encode as base36 if required
                 if definitions[parameters[i]][6] == 2:
@@ -214,6 +188,83 @@ def read(fh):  # fh is a filehandle
     return imma_local
 
 
+# Read a line into an existing record (replacing its contents)
+#  Re-using one record avoids making a new object for each line
+#  params - only decode these parameters (the others are left out of the record's data)
+def read_into(record, line, params=None):
+    if params is None:
+        record.read(line)
+        return record
+    line = line.rstrip('\n')
+    record.clear()
+    spans = attachment_spans(line)
+    for attachment, start, end in spans:
+        record.attachments.append(attachment)
+    _decode_params(line, spans, params, record.data)
+    return record
+
+
+# Read a file into a pandas DataFrame (needs pandas - see IMMA.frame)
+def to_dataframe(path, params=None, chunksize=None, where=None):
+    from .frame import to_dataframe as frame_to_dataframe
+    return frame_to_dataframe(path, params, chunksize, where)
+
+
+# Open an IMMA file for reading or writing, gzip compressed if the name ends in .gz
+#  Text is latin-1 (whatever the locale), so any byte can be read and written back
+def open_file(filename, mode='r'):
+    if 'b' in mode:
+        if filename.endswith('.gz'):
+            return gzip.open(filename, mode)
+        return open(filename, mode)
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode + 't', encoding='latin-1')
+    return open(filename, mode, encoding='latin-1')
+
+
+# Iterate over the records in a file
+#  params - only keep these parameters in each record's data (projection)
+#  where  - only yield records for which where(record) is true (predicate)
+#  reuse  - yield the same record each time, overwritten by each line
+#           (faster, but a record is only valid until the next one is read)
+def records(fh, params=None, where=None, reuse=False):
+    imma_local = IMMA()
+    for line in fh:
+        if len(line.strip()) == 0:
+            continue
+        if reuse:
+            # Without a predicate (which may want any parameter), only params need decoding
+            read_into(imma_local, line, params if where is None else None)
+        else:
+            imma_local = read(line)
+        if where is not None and not where(imma_local):
+            continue
+        if params is not None:
+            if reuse:
+                _project(imma_local.data, params)
+            else:
+                imma_local.data = dict((p, imma_local.data.get(p)) for p in params)
+        yield imma_local
+
+
+# Cut a record's data down to params in place (adding None for any not there)
+def _project(data, params):
+    for p in [p for p in data if p not in params]:
+        del data[p]
+    for p in params:
+        if p not in data:
+            data[p] = None
+
+
+# Read the selected parameters from a file into one list per parameter
+def columns(fh, params, where=None):
+    result = dict((p, []) for p in params)
+    for imma_local in records(fh, params, where, reuse=True):
+        for p in params:
+            result[p].append(imma_local.data[p])
+    return result
+
+
 def get_attachment(i):
     if "%02d" % i not in attachment:
         return None
@@ -232,6 +283,125 @@ def get_definitions(i):
     return definitions["%02d" % i]
 
 
+# Find the attachments in the string representation of a record
+#  Returns (attachment number, start, end) for each, where start and end
+#  are positions in the string (end may be beyond the end of the string
+#  if trailing blanks have been stripped).
+def attachment_spans(line):
+    line = line.rstrip('\n')
+    spans = []
+
+    # Core is always present (and first)
+    attachment = 0
+    start = 0
+    length = 108
+
+    while start < len(line):
+
+        if length is None or length == 0:  # Undefined length - the rest of the line
+            spans.append((attachment, start, len(line)))
+            break
+        spans.append((attachment, start, start + length))
+
+        start += length
+        if start < len(line):
+            attachment = int(line[start:start + 2])
+            length = line[start + 2:start + 4]
+
+            if re.search(r'\S', length) is None:
+                length = None
+
+            if length is not None:
+                length = int(length)
+                if length != 0:
+                    length -= 4
+            start += 4
+
+            if get_attachment(attachment) is None:
+                raise Exception("Bad IMMA string - Unsupported attachment ID %d" % attachment)
+
+    return spans
+
+
+# Convert the string representation of a parameter to its value
+#  (None if it is blank or can't be decoded)
+def decode_value(value, definition):
+
+    # Blanks mean value is undefined
+    if re.search(r'\S', value) is None:
+        return None
+
+    if definition[6] == 2:
+        value = decode_base36(value)
+
+    if definition[6] == 1:
+        if value.strip() == '-' or ' ' in value.strip():
+            return None
+        try:
+            value = int(value)
+        except ValueError:
+            return None
+
+    if definition[5] is not None and definition[5] != 1.0:
+        value = int(value) * definition[5]
+
+    return value
+
+
+# Position (offset, length) of each parameter within an attachment
+def get_offsets(i):
+    if i not in offsets:
+        if get_parameters(i) is None:
+            return None
+        result = {}
+        position = 0
+        for p in get_parameters(i):
+            result[p] = (position, get_definitions(i)[p][0])
+            if get_definitions(i)[p][0] is not None:
+                position += get_definitions(i)[p][0]
+        offsets[i] = result
+    return offsets[i]
+
+
+# Decode only the selected parameters from the string representation of a record
+#  Returns a dictionary of parameter values (None for parameters not in the record)
+def peek(line, params):
+    line = line.rstrip('\n')
+    return _decode_params(line, attachment_spans(line), params, {})
+
+
+# Decode the selected parameters of a line, split into attachments, into result
+def _decode_params(line, spans, params, result):
+    for p in params:
+        result[p] = None
+    for attachment, start, end in spans:
+        attachment_offsets = get_offsets(attachment)
+        for p in params:
+            if p not in attachment_offsets:
+                continue
+            offset, length = attachment_offsets[p]
+            if length is None:
+                value = line[start + offset:end]
+            else:
+                value = line[start + offset:start + offset + length]
+                value += " " * (length - len(value))
+            result[p] = decode_value(value, get_definitions(attachment)[p])
+    return result
+
+
+# Return nearest integer to given float
+#  (rounding halves towards zero, for negative numbers as for positive ones)
+def nint(x):
+    n = int(x)
+    if x > 0:
+        if x - n > 0.5:
+            return n + 1
+        return n
+    if n - x > 0.5:
+        return n - 1
+    return n
+
+
 # Convert a single-digit base36 value to base 10
 def decode_base36(t):
     return '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'.find(t)
@@ -249,6 +419,7 @@ def encode_base36(t):
 attachment = {}  # Dictionaries, so indexed by %02d string
 parameters = {}
 definitions = {}
+offsets = {}  # Cache for get_offsets, indexed by attachment number
 
 #
 # Core attachment
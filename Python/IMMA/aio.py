@@ -0,0 +1,239 @@
+# asyncio reading and writing of IMMA records
+#  Decoding and encoding are done a block of records at a time in an
+#  executor (thread or process pool), so a large file doesn't stall the
+#  event loop; a semaphore bounds the blocks in progress, shared between
+#  all the streams using the same BlockDecoder, so one stream can't take
+#  all the workers. Each event loop has its own semaphore (asyncio
+#  objects can't be used from another loop), so the bound is per loop.
+
+import asyncio
+import collections
+import concurrent.futures
+import inspect
+import io
+import os
+import threading
+import weakref
+
+from . import IMMA
+
+# Bytes read from a stream at a time
+BLOCK_SIZE = 1 << 20
+
+
+def decode_block(block):
+    """
+    Decode a block of complete lines
+
+    :param block: The lines
+    :type block: bytes
+
+    :return: The records
+    :rtype: list of IMMA
+    """
+    result = []
+    for line in block.decode('latin-1').split('\n'):
+        if len(line.strip()) == 0:
+            continue
+        record = IMMA()
+        record.read(line)
+        result.append(record)
+    return result
+
+
+def encode_block(records):
+    """
+    Encode a block of records
+
+    :param records: The records
+    :type records: list of IMMA
+
+    :return: The lines
+    :rtype: bytes
+    """
+    buffer = io.StringIO()
+    for record in records:
+        record.write(buffer)
+    return buffer.getvalue().encode('latin-1')
+
+
+class BlockDecoder(object):
+    """
+    Runs block decoding and encoding in an executor, with a bound on the blocks in progress
+    """
+
+    def __init__(self, executor=None, max_workers=None, processes=False, limit=None):
+        """
+        :param executor: Executor to use (default is a new thread or process pool)
+        :type executor: concurrent.futures.Executor
+        :param max_workers: Size of the new pool
+        :type max_workers: int
+        :param processes: Make a process pool rather than a thread pool
+        :type processes: bool
+        :param limit: Maximum number of blocks in progress at once (default is twice the workers)
+        :type limit: int
+        """
+        if max_workers is None:
+            max_workers = min(4, os.cpu_count() or 1)
+        if executor is None:
+            if processes:
+                executor = concurrent.futures.ProcessPoolExecutor(max_workers)
+            else:
+                executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        self.executor = executor
+        self.limit = limit if limit is not None else 2 * max_workers
+        # Event loop -> its semaphore, made on first use in that loop
+        self._semaphores = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _get_semaphore(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = asyncio.Semaphore(self.limit)
+                self._semaphores[loop] = semaphore
+        return semaphore
+
+    async def run(self, function, *args):
+        async with self._get_semaphore():
+            return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def decode(self, block):
+        return await self.run(decode_block, block)
+
+    async def encode(self, records):
+        return await self.run(encode_block, records)
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+_default_decoder = None
+
+
+def default_decoder():
+    """
+    :return: The BlockDecoder used when none is given (a shared thread pool)
+    """
+    global _default_decoder
+    if _default_decoder is None:
+        _default_decoder = BlockDecoder()
+    return _default_decoder
+
+
+async def _read(stream, n):
+    # Read from an asyncio stream, or from an ordinary file without blocking the loop
+    if inspect.iscoroutinefunction(stream.read):
+        data = await stream.read(n)
+    else:
+        data = await asyncio.get_running_loop().run_in_executor(None, stream.read, n)
+    if isinstance(data, str):
+        raise Exception("Stream gives text - open it in binary mode ('rb')")
+    return data
+
+
+async def aiter_records(stream, decoder=None, block_size=BLOCK_SIZE, max_pending=2):
+    """
+    Iterate over the records in a stream without blocking the event loop
+
+    Usage: async for record in aiter_records(stream): ...
+
+    :param stream: asyncio.StreamReader (or anything with an async read(n) giving bytes),
+        or an ordinary file opened for binary reading
+    :param decoder: Where to decode the blocks (default is default_decoder())
+    :type decoder: BlockDecoder
+    :param block_size: Bytes to read at a time
+    :type block_size: int
+    :param max_pending: Blocks read ahead and being decoded for this stream
+    :type max_pending: int
+
+    :return: async generator of IMMA records
+    """
+    if decoder is None:
+        decoder = default_decoder()
+    pending = collections.deque()
+    partial = b''
+    try:
+        while True:
+            data = await _read(stream, block_size)
+            if len(data) > 0:
+                data = partial + data
+                cut = data.rfind(b'\n')
+                if cut < 0:
+                    partial = data
+                    continue
+                block, partial = data[:cut + 1], data[cut + 1:]
+            else:  # End of stream - the last line may have no newline
+                block, partial = partial, b''
+            if len(block) > 0:
+                pending.append(asyncio.ensure_future(decoder.decode(block)))
+            while len(pending) >= max_pending or (len(data) == 0 and len(pending) > 0):
+                for record in await pending.popleft():
+                    yield record
+            if len(data) == 0:
+                return
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+class AsyncWriter(object):
+    """
+    Write records to a stream in batches, encoded in an executor
+
+    Usage::
+
+        writer = AsyncWriter(stream)
+        for record in records:
+            await writer.write(record)
+        await writer.close()
+    """
+
+    def __init__(self, stream, decoder=None, batch_size=1000):
+        """
+        :param stream: asyncio.StreamWriter (write(data) and async drain()),
+            or an ordinary file opened for binary writing
+        :param decoder: Where to encode the batches (default is default_decoder())
+        :type decoder: BlockDecoder
+        :param batch_size: Records to encode at a time
+        :type batch_size: int
+        """
+        self.stream = stream
+        self.decoder = decoder if decoder is not None else default_decoder()
+        self.batch_size = batch_size
+        self.batch = []
+
+    async def write(self, record):
+        """
+        Add a record - the batch is written out when full
+        """
+        self.batch.append(record)
+        if len(self.batch) >= self.batch_size:
+            await self.flush()
+
+    async def write_many(self, records):
+        for record in records:
+            await self.write(record)
+
+    async def flush(self):
+        """
+        Encode and write the current batch, waiting for the stream to drain
+        """
+        if len(self.batch) == 0:
+            return
+        batch = self.batch
+        self.batch = []
+        data = await self.decoder.encode(batch)
+        drain = getattr(self.stream, 'drain', None)
+        if drain is not None:
+            self.stream.write(data)
+            await drain()
+        else:
+            await asyncio.get_running_loop().run_in_executor(None, self.stream.write, data)
+
+    async def close(self):
+        """
+        Write any records left (the stream is not closed)
+        """
+        await self.flush()
@@ -0,0 +1,484 @@
+# The imma command: filter, cut, convert, summarise, sort, index and serve IMMA files
+#
+# Usage: imma <command> [options] [files...]
+#  Files may be gzip compressed; with no files (or '-') records are read
+#  from standard input, and output goes to standard output unless -o is
+#  given. Records are processed in chunks spread over --jobs processes.
+
+import argparse
+import collections
+import csv
+import gzip
+import heapq
+import io
+import json
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+
+from . import columns, definitions, open_file, peek, records
+from .stats import StatsCollector
+
+# Lines in each chunk sent to a worker
+CHUNK = 10000
+
+
+def _input_lines(filenames):
+    # The lines of each input in turn ('-' is standard input, which may be gzipped)
+    for filename in filenames or ['-']:
+        if filename == '-':
+            stdin = sys.stdin.buffer
+            if stdin.peek(2)[:2] == b'\x1f\x8b':
+                stdin = gzip.GzipFile(fileobj=stdin)
+            fh = io.TextIOWrapper(stdin, encoding='latin-1')
+            for line in fh:
+                yield line
+            fh.detach()
+        else:
+            with open_file(filename) as fh:
+                for line in fh:
+                    yield line
+
+
+def _chunks(lines, size=CHUNK):
+    # Blank lines are dropped, and every line ends with '\n' (the last line
+    #  of a file may have none, and would run into the next in the output)
+    chunk = []
+    for line in lines:
+        if len(line.strip()) == 0:
+            continue
+        chunk.append(line.rstrip('\r\n') + '\n')
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def _parallel_map(function, tasks, jobs):
+    # Like Pool.imap, but reading no more than 2 * jobs tasks ahead,
+    #  so a long input stream isn't all read into memory
+    if jobs == 1:
+        for task in tasks:
+            yield function(task)
+        return
+    pool = multiprocessing.Pool(jobs)
+    try:
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(pool.apply_async(function, (task,)))
+            while len(pending) >= 2 * (jobs or os.cpu_count() or 1):
+                yield pending.popleft().get()
+        while len(pending) > 0:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+
+
+class _Output(object):
+    # Standard output, or a file (gzip compressed if the name ends in .gz)
+
+    def __init__(self, filename, binary=False):
+        self.filename = filename
+        self.binary = binary
+
+    def __enter__(self):
+        if self.filename is None or self.filename == '-':
+            # Text goes out as latin-1, as it is read, whatever the locale
+            sys.stdout.flush()
+            self.fh = sys.stdout.buffer if self.binary else io.TextIOWrapper(sys.stdout.buffer,
+                                                                            encoding='latin-1')
+            self.close = False
+        else:
+            self.fh = open_file(self.filename, 'wb' if self.binary else 'w')
+            self.close = True
+        return self.fh
+
+    def __exit__(self, *args):
+        if self.close:
+            self.fh.close()
+        else:
+            self.fh.flush()
+            if not self.binary:
+                self.fh.detach()  # Leave standard output open
+
+
+# Predicates
+
+_CONDITION = re.compile(r'^\s*(\w+)\s*(==|!=|<=|>=|<|>|=|\s+in\s+)\s*(\S.*?)\s*$')
+
+
+def _value(text):
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+class Predicate(object):
+    """
+    Conditions on parameter values, e.g. 'SST>20', 'DCK in 701,702', 'ID==LIBERTY'
+
+    Only the parameters in the conditions are decoded. A missing value fails every condition.
+    """
+
+    def __init__(self, conditions):
+        self.conditions = []
+        for condition in conditions:
+            match = _CONDITION.match(condition)
+            if match is None:
+                raise Exception("Bad condition '%s' - use e.g. SST>20 or 'DCK in 701,702'" % condition)
+            p, op, value = match.groups()
+            if not any(p in definitions[attachment] for attachment in definitions):
+                raise Exception("Unknown parameter %s in condition '%s'" % (p, condition))
+            op = op.strip()
+            if op == 'in':
+                value = set(_value(v.strip()) for v in value.split(','))
+            else:
+                value = _value(value)
+            self.conditions.append((p, '==' if op == '=' else op, value))
+        self.params = [p for p, op, value in self.conditions]
+
+    def __call__(self, line):
+        values = peek(line, self.params)
+        for p, op, target in self.conditions:
+            value = values[p]
+            if value is None:
+                return False
+            if isinstance(value, str):
+                value = value.strip()
+            try:
+                if not ((op == '==' and value == target) or
+                        (op == '!=' and value != target) or
+                        (op == '<' and value < target) or
+                        (op == '<=' and value <= target) or
+                        (op == '>' and value > target) or
+                        (op == '>=' and value >= target) or
+                        (op == 'in' and value in target)):
+                    return False
+            except TypeError:  # Comparing a string with a number
+                return False
+        return True
+
+
+# Workers (module-level functions, so they can be sent to other processes)
+
+def _filter_chunk(task):
+    chunk, predicate = task
+    return ''.join(line for line in chunk if predicate(line))
+
+
+def _columns_chunk(task):
+    chunk, params, predicate = task
+    if predicate is not None:
+        chunk = [line for line in chunk if predicate(line)]
+    return columns(chunk, params)
+
+
+def _stats_chunk(task):
+    chunk, params, predicate = task
+    collector = StatsCollector(params)
+    if predicate is not None:
+        chunk = [line for line in chunk if predicate(line)]
+    if params is None:
+        for record in records(chunk, reuse=True):
+            collector.add(record)
+    else:
+        collector.add_columns(columns(chunk, params))
+    return collector
+
+
+def _keys_chunk(task):
+    chunk, params = task
+    return [_sort_key(peek(line, params), params) for line in chunk]
+
+
+def _sort_key(values, params):
+    # Missing values sort last
+    return tuple((values[p] is None, values[p]) for p in params)
+
+
+# Commands
+
+def _predicate(args):
+    return Predicate(args.where) if args.where else None
+
+
+def _params(text):
+    return [p.strip() for p in text.split(',') if p.strip() != ''] if text else None
+
+
+def _column_chunks(args, params):
+    predicate = _predicate(args)
+    tasks = ((chunk, params, predicate) for chunk in _chunks(_input_lines(args.files)))
+    return _parallel_map(_columns_chunk, tasks, args.jobs)
+
+
+def _write_csv(args, params, delimiter):
+    with _Output(args.output) as out:
+        writer = csv.writer(out, delimiter=delimiter, lineterminator='\n')
+        writer.writerow(params)
+        for part in _column_chunks(args, params):
+            for row in zip(*[part[p] for p in params]):
+                writer.writerow(['' if v is None else round(v, 6) if isinstance(v, float) else v
+                                 for v in row])
+
+
+def command_filter(args):
+    predicate = _predicate(args)
+    if predicate is None:
+        raise Exception("filter needs at least one --where condition")
+    tasks = ((chunk, predicate) for chunk in _chunks(_input_lines(args.files)))
+    with _Output(args.output) as out:
+        for text in _parallel_map(_filter_chunk, tasks, args.jobs):
+            out.write(text)
+
+
+def command_cut(args):
+    _write_csv(args, _params(args.params), args.delimiter)
+
+
+def command_convert(args):
+    params = _params(args.params)
+    if args.to == 'csv':
+        return _write_csv(args, params, ',')
+    if args.to == 'npy':
+        return _write_npy(args, params)
+    if args.to == 'parquet':
+        return _write_parquet(args, params)
+
+
+def _write_npy(args, params):
+    import numpy
+    from .shared import MISSING_INT, column_type
+    dtypes = []
+    for p in params:
+        kind, width = column_type(p)
+        dtypes.append((p, {'d': 'f8', 'i': 'i4'}.get(kind, 'S%d' % width)))
+    parts = []
+    for part in _column_chunks(args, params):
+        n = len(part[params[0]])
+        block = numpy.empty(n, dtype=dtypes)
+        for p, kind in dtypes:
+            if kind == 'f8':
+                block[p] = [numpy.nan if v is None else v for v in part[p]]
+            elif kind == 'i4':
+                block[p] = [MISSING_INT if v is None else v for v in part[p]]
+            else:
+                block[p] = [(v or '').encode('latin-1') for v in part[p]]
+        parts.append(block)
+    result = numpy.concatenate(parts) if len(parts) > 0 else numpy.empty(0, dtype=dtypes)
+    with _Output(args.output, binary=True) as out:
+        numpy.save(out, result)
+
+
+def _write_parquet(args, params):
+    import pandas
+    import pyarrow
+    import pyarrow.parquet
+    from .frame import _column
+    writer = None
+    try:
+        with _Output(args.output, binary=True) as out:
+            for part in _column_chunks(args, params):
+                frame = pandas.DataFrame(dict((p, _column(part[p], p)) for p in params))
+                for p in params:  # Keep the schema the same for every chunk
+                    if isinstance(frame[p].dtype, pandas.CategoricalDtype):
+                        frame[p] = frame[p].astype('string')
+                table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+                if writer is None:
+                    writer = pyarrow.parquet.ParquetWriter(out, table.schema)
+                writer.write_table(table)
+            if writer is not None:
+                writer.close()
+                writer = None
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def command_stats(args):
+    params = _params(args.params)
+    predicate = _predicate(args)
+    tasks = ((chunk, params, predicate) for chunk in _chunks(_input_lines(args.files)))
+    result = StatsCollector(params)
+    for part in _parallel_map(_stats_chunk, tasks, args.jobs):
+        result.merge(part)
+    with _Output(args.output) as out:
+        json.dump(result.result(), out, indent=1, default=str)
+        out.write('\n')
+
+
+def command_sort(args):
+    params = _params(args.keys)
+    runs = []
+    try:
+        # Sort the input in runs of --buffer lines, spilling them to disc if there's more than one
+        lines = []
+        keys = []
+        for chunk, chunk_keys in _keyed_chunks(args, params):
+            lines.extend(chunk)
+            keys.extend(chunk_keys)
+            if len(lines) >= args.buffer:
+                runs.append(_spill(lines, keys))
+                lines = []
+                keys = []
+        order = sorted(range(len(lines)), key=keys.__getitem__)
+        with _Output(args.output) as out:
+            if len(runs) == 0:
+                for i in order:
+                    out.write(lines[i])
+                return
+            runs.append(_spill(lines, keys))
+            files = [open(run, encoding='latin-1') for run in runs]
+            try:
+                merged = heapq.merge(*files, key=lambda line: _sort_key(peek(line, params), params))
+                for line in merged:
+                    out.write(line)
+            finally:
+                for fh in files:
+                    fh.close()
+    finally:
+        for run in runs:
+            os.remove(run)
+
+
+def _keyed_chunks(args, params):
+    chunks = _chunks(_input_lines(args.files))
+    # Find the keys in parallel, keeping each chunk to go with its keys
+    pending = collections.deque()
+
+    def tasks():
+        for chunk in chunks:
+            pending.append(chunk)
+            yield (chunk, params)
+
+    for keys in _parallel_map(_keys_chunk, tasks(), args.jobs):
+        yield pending.popleft(), keys
+
+
+def _spill(lines, keys):
+    fd, filename = tempfile.mkstemp(suffix='.imma')
+    with os.fdopen(fd, 'w', encoding='latin-1') as fh:
+        for i in sorted(range(len(lines)), key=keys.__getitem__):
+            fh.write(lines[i])
+    return filename
+
+
+def _index_file(filename):
+    from .index import load_index
+    return filename, len(load_index(filename))
+
+
+def command_index(args):
+    if not args.files:
+        raise Exception("index needs files (not standard input)")
+    for filename, n in _parallel_map(_index_file, args.files, args.jobs):
+        sys.stderr.write('%s: %d records\n' % (filename, n))
+    if args.tracks is not None:
+        from .tracks import TrackIndex
+        TrackIndex(args.files).save(args.tracks)
+
+
+def command_serve(args):
+    if not args.files:
+        raise Exception("serve needs files (not standard input)")
+    from .server import serve
+    sys.stderr.write('Serving %d files on %s\n' % (
+        len(args.files), args.socket or 'http://%s:%d' % (args.host, args.port)))
+    serve(args.files, address=(args.host, args.port), socket=args.socket,
+          block_size=args.block_size, cache_records=args.cache, workers=args.jobs or os.cpu_count(),
+          limit=args.limit, quiet=not args.verbose, directory=args.index_dir)
+
+
+def parser():
+    """
+    :return: The argument parser for the imma command
+    :rtype: argparse.ArgumentParser
+    """
+    result = argparse.ArgumentParser(prog='imma', description='Process IMMA files')
+    commands = result.add_subparsers(dest='command')
+    commands.required = True
+
+    def command(name, function, help):
+        sub = commands.add_parser(name, help=help)
+        sub.set_defaults(function=function, subparser=sub)
+        sub.add_argument('files', nargs='*', help="Input files (default, or '-', is standard input)")
+        sub.add_argument('-o', '--output', default=None, help='Output file (default is standard output)')
+        sub.add_argument('-j', '--jobs', type=int, default=None,
+                         help='Worker processes (default is one per CPU)')
+        return sub
+
+    sub = command('filter', command_filter, 'Select the records meeting conditions')
+    sub.add_argument('-w', '--where', action='append', default=[],
+                     help="Condition, e.g. 'SST>20' or 'DCK in 701,702' (repeat for more)")
+
+    sub = command('cut', command_cut, 'Output selected parameters as delimited text')
+    sub.add_argument('-p', '--params', required=True, help='Comma-separated parameters')
+    sub.add_argument('-d', '--delimiter', default=',')
+    sub.add_argument('-w', '--where', action='append', default=[], help='Condition, as for filter')
+
+    sub = command('convert', command_convert, 'Convert selected parameters to CSV, NPY or Parquet')
+    sub.add_argument('-p', '--params', required=True, help='Comma-separated parameters')
+    sub.add_argument('-t', '--to', choices=('csv', 'npy', 'parquet'), default='csv')
+    sub.add_argument('-w', '--where', action='append', default=[], help='Condition, as for filter')
+
+    sub = command('stats', command_stats, 'Summary statistics (JSON)')
+    sub.add_argument('-p', '--params', default=None, help='Comma-separated parameters (default is all)')
+    sub.add_argument('-w', '--where', action='append', default=[], help='Condition, as for filter')
+
+    sub = command('sort', command_sort, 'Sort records by parameters')
+    sub.add_argument('-k', '--keys', default='YR,MO,DY,HR', help='Comma-separated parameters to sort by')
+    sub.add_argument('-b', '--buffer', type=int, default=1000000,
+                     help='Lines sorted in memory at once (more are merged through temporary files)')
+
+    sub = command('index', command_index, 'Make line-offset (.idx) indexes of files')
+    sub.add_argument('--tracks', default=None, help='Also write a ship-track index to this file')
+
+    sub = command('serve', command_serve, 'Answer box, time and ship queries over HTTP (-j sets the worker threads)')
+    sub.add_argument('--host', default='127.0.0.1')
+    sub.add_argument('--port', type=int, default=8036)
+    sub.add_argument('--socket', default=None, help='Listen on this Unix socket instead')
+    sub.add_argument('--block-size', type=int, default=1000, help='Records in each cached block')
+    sub.add_argument('--cache', type=int, default=1000000, help='Most decoded records to keep in the cache')
+    sub.add_argument('--limit', type=int, default=100000,
+                     help='Most records returned by a query that gives no limit')
+    sub.add_argument('--index-dir', default=None,
+                     help='Directory for the index and summary files (default is alongside each file)')
+    sub.add_argument('-v', '--verbose', action='store_true', help='Log each request')
+
+    return result
+
+
+def _check(args):
+    # Mistakes in the command line that argparse can't see for itself
+    if args.command == 'filter' and not args.where:
+        raise Exception("filter needs at least one --where condition")
+    if args.command in ('index', 'serve') and not args.files:
+        raise Exception("%s needs files (not standard input)" % args.command)
+    if getattr(args, 'where', None):
+        Predicate(args.where)
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    try:
+        _check(args)
+    except Exception as e:
+        args.subparser.error(str(e))  # Exits with status 2, like argparse's own errors
+    try:
+        args.function(args)
+    except BrokenPipeError:  # e.g. piped into head
+        sys.stderr.close()
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
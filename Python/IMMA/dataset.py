@@ -0,0 +1,206 @@
+# A set of IMMA files under a directory, partitioned by year and month
+#  ICOADS files are named by the period they cover (e.g. IMMA1_R3.0.0_1850-01.gz),
+#  so a time filter can skip files without opening them.
+
+import multiprocessing
+import os
+import re
+
+from . import columns, derived, open_file, records
+from .stats import StatsCollector
+
+# Year and month at the end of a file name, with no extension or an IMMA data
+#  one (.imma, .txt, and/or .gz) - so index and other files kept alongside
+#  the data (.idx, .blocks, checkpoints) aren't taken for data
+DEFAULT_PATTERN = r'.*(?P<year>\d{4})[-_]?(?P<month>\d{2})(\.imma|\.txt)?(\.gz)?$'
+
+
+def _period(value):
+    # Accept a year or a (year, month) pair
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return (value, None)
+    return tuple(value)
+
+
+def _after(partition, start):
+    # True if the partition might contain data at or after start
+    if start is None or partition[0] is None:
+        return True
+    if partition[0] != start[0] or partition[1] is None or start[1] is None:
+        return partition[0] >= start[0]
+    return partition[1] >= start[1]
+
+
+def _before(partition, end):
+    # True if the partition might contain data at or before end
+    if end is None or partition[0] is None:
+        return True
+    if partition[0] != end[0] or partition[1] is None or end[1] is None:
+        return partition[0] <= end[0]
+    return partition[1] <= end[1]
+
+
+class _TimeFilter(object):
+    # Record predicate combining a time range with a user predicate
+    #  (a class rather than a closure so it can be sent to worker processes)
+
+    def __init__(self, start, end, where):
+        self.start = start
+        self.end = end
+        self.where = where
+
+    def __call__(self, record):
+        partition = (record.data.get('YR'), record.data.get('MO'))
+        if not (_after(partition, self.start) and _before(partition, self.end)):
+            return False
+        return self.where is None or self.where(record)
+
+
+def _scan_records(args):
+    filename, params, where = args
+    with open_file(filename) as fh:
+        return list(records(fh, params, where))
+
+
+def _scan_columns(args):
+    filename, params, where = args
+    with open_file(filename) as fh:
+        return columns(fh, params, where)
+
+
+def _scan_stats(args):
+    filename, params, where = args
+    collector = StatsCollector(params)
+    with open_file(filename) as fh:
+        for record in records(fh, params, where, reuse=True):
+            collector.add(record)
+    return collector
+
+
+class IMMADataset(object):
+    """
+    The IMMA files under a directory, with year/month partitions taken from their names
+    """
+
+    def __init__(self, root, pattern=DEFAULT_PATTERN):
+        """
+        :param root: Directory to search (recursively) for IMMA files
+        :type root: str
+
+        :param pattern: Regular expression matched against each file name;
+            only matching files are used. Named groups 'year' and (optionally)
+            'month' give the partition of the file.
+        :type pattern: str
+        """
+        self.root = root
+        self.pattern = re.compile(pattern)
+        self.partitions = []  # (year, month, filename), sorted
+        for directory, subdirectories, filenames in os.walk(root):
+            subdirectories.sort()
+            for name in filenames:
+                match = self.pattern.search(name)
+                if match is None:
+                    continue
+                groups = match.groupdict()
+                year = groups.get('year')
+                month = groups.get('month')
+                self.partitions.append((int(year) if year is not None else None,
+                                        int(month) if month is not None else None,
+                                        os.path.join(directory, name)))
+        self.partitions.sort(key=lambda p: (p[0] is None, p[0] or 0, p[1] or 0, p[2]))
+
+    def __len__(self):
+        return len(self.partitions)
+
+    def files(self, start=None, end=None):
+        """
+        The files that may contain records in a time range
+
+        :param start: First year, or (year, month), wanted
+        :type start: int or tuple
+        :param end: Last year, or (year, month), wanted
+        :type end: int or tuple
+
+        :return: File names
+        :rtype: list
+        """
+        start = _period(start)
+        end = _period(end)
+        return [filename for year, month, filename in self.partitions
+                if _after((year, month), start) and _before((year, month), end)]
+
+    def _scan(self, worker, params, where, start, end, processes):
+        if start is not None or end is not None:
+            where = _TimeFilter(_period(start), _period(end), where)
+        tasks = [(filename, params, where) for filename in self.files(start, end)]
+        if processes == 1 or len(tasks) < 2:
+            for task in tasks:
+                yield worker(task)
+            return
+        pool = multiprocessing.Pool(processes)
+        try:
+            for result in pool.imap(worker, tasks):
+                yield result
+        finally:
+            pool.terminate()
+
+    def records(self, params=None, where=None, start=None, end=None, processes=None):
+        """
+        Iterate over the records in the dataset
+
+        Files are read in parallel, one file per task, and the records
+        come back in file order.
+
+        :param params: Only keep these parameters in each record's data
+        :type params: list
+        :param where: Only yield records for which where(record) is true -
+            must be picklable (a module-level function) if processes != 1
+        :type where: callable
+        :param start: First year, or (year, month), wanted
+        :type start: int or tuple
+        :param end: Last year, or (year, month), wanted
+        :type end: int or tuple
+        :param processes: Number of worker processes (default is one per CPU)
+        :type processes: int
+
+        :return: generator of IMMA records
+        """
+        for result in self._scan(_scan_records, params, where, start, end, processes):
+            for record in result:
+                yield record
+
+    def columns(self, params, where=None, start=None, end=None, processes=None):
+        """
+        Read the selected parameters from the dataset into one list per parameter
+
+        params may include derived variables (see IMMA.derived): only the
+        parameters they need are read, and they are computed afterwards.
+        Other arguments are as for records.
+
+        :return: dict of parameter name -> list of values
+        """
+        needed = derived.expand(params)
+        result = dict((p, []) for p in needed)
+        for part in self._scan(_scan_columns, needed, where, start, end, processes):
+            for p in needed:
+                result[p].extend(part[p])
+        derived.compute(result, params)
+        return dict((p, result[p]) for p in params)
+
+    def stats(self, params=None, where=None, start=None, end=None, processes=None):
+        """
+        Summary statistics for the dataset, collected in parallel and merged
+
+        :param params: Parameters to summarise (default is all of them)
+        :type params: list
+
+        Other arguments are as for records.
+
+        :return: IMMA.stats.StatsCollector
+        """
+        result = StatsCollector(params)
+        for part in self._scan(_scan_stats, params, where, start, end, processes):
+            result.merge(part)
+        return result
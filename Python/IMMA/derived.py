@@ -0,0 +1,352 @@
+# Derived variables, computed from columns of decoded IMMA parameters
+#  Each derived variable declares the parameters it is computed from, so
+#  a request for it reads only those parameters. Results are stored in
+#  the columns dictionary alongside the decoded parameters, so each is
+#  only computed once.
+#
+# With numpy installed, each variable is computed over whole columns at
+#  once (missing values as NaN); otherwise one value at a time. Either
+#  way the results are lists, with None for missing values.
+
+import math
+
+from . import columns as read_columns
+from . import definitions
+
+try:
+    import numpy
+except ImportError:  # The derived variables fall back to pure Python
+    numpy = None
+
+# Derived variable name -> (inputs, function, description)
+#  function is called with one list per input, and returns a list
+registry = {}
+
+
+def _is_parameter(name):
+    # Is name an IMMA parameter (in any attachment)?
+    for attachment in definitions.values():
+        if name in attachment:
+            return True
+    return False
+
+
+def register(name, inputs, description=''):
+    """
+    Decorator adding a derived variable to the registry
+
+    :param name: Name of the derived variable - must not be an IMMA parameter
+    :type name: str
+    :param inputs: Parameters (or other derived variables) it is computed from
+    :type inputs: sequence of str
+    :param description: What it is, and its units
+    :type description: str
+    """
+    if _is_parameter(name):
+        raise Exception("Derived variable %s has the name of an IMMA parameter" % name)
+
+    def add(function):
+        registry[name] = (tuple(inputs), function, description)
+        return function
+    return add
+
+
+def _map(function, *columns):
+    # Apply function to each set of values, giving None if any value is None
+    return [None if None in values else function(*values) for values in zip(*columns)]
+
+
+def _to_list(values, kind=float):
+    # numpy array -> list, with None for NaN
+    return [None if v != v else kind(v) for v in values.tolist()]
+
+
+def _apply(scalar, vector, *columns, kind=float):
+    # Compute a variable with vector (numpy arrays, NaN for missing) if numpy
+    #  is installed, otherwise with scalar (one set of values at a time,
+    #  skipping any with a missing value). kind is the type of the values.
+    if numpy is None:
+        return _map(scalar, *columns)
+    with numpy.errstate(invalid='ignore'):
+        return _to_list(vector(*[numpy.asarray(c, dtype=float) for c in columns]), kind)
+
+
+def expand(params):
+    """
+    Find the decoded parameters needed for a set of parameters and derived variables
+
+    :param params: Parameters and derived variables
+    :type params: sequence of str
+
+    :return: The IMMA parameters needed, in first-use order
+    :rtype: list
+    """
+    result = []
+    for p in params:
+        if p in registry:
+            needed = expand(registry[p][0])
+        else:
+            needed = [p]
+        for q in needed:
+            if q not in result:
+                result.append(q)
+    return result
+
+
+def compute(columns, names):
+    """
+    Add derived variables to a set of columns
+
+    Variables already in columns are not computed again.
+
+    :param columns: Parameter name -> list of values (as from IMMA.columns)
+    :type columns: dict
+    :param names: Derived variables wanted
+    :type names: sequence of str
+
+    :return: columns, with the derived variables added
+    :rtype: dict
+    """
+    for name in names:
+        if name in columns or name not in registry:
+            continue
+        inputs, function, description = registry[name]
+        compute(columns, inputs)
+        columns[name] = function(*[columns[p] for p in inputs])
+    return columns
+
+
+def columns(fh, params, where=None):
+    """
+    Read parameters and derived variables from a file into one list per variable
+
+    Only the parameters needed are kept, and the derived variables are
+    computed from them once the file has been read.
+
+    :param fh: The filehandle
+    :type fh: file handle
+    :param params: Parameters and derived variables
+    :type params: sequence of str
+    :param where: Only use records for which where(record) is true
+    :type where: callable
+
+    :return: dict of name -> list of values (for the names in params)
+    """
+    result = compute(read_columns(fh, expand(params), where), params)
+    return dict((p, result[p]) for p in params)
+
+
+# Wind
+
+def _calm(direction):
+    # D 361 is calm, 362 is variable direction
+    return direction == 361
+
+
+def _wind_u(direction, speed):
+    if _calm(direction):
+        return 0.0
+    if direction > 360:
+        return None
+    return -speed * math.sin(math.radians(direction))
+
+
+def _wind_v(direction, speed):
+    if _calm(direction):
+        return 0.0
+    if direction > 360:
+        return None
+    return -speed * math.cos(math.radians(direction))
+
+
+def _wind_component(direction, speed, trig):
+    # Vector version of _wind_u (trig numpy.sin) and _wind_v (numpy.cos)
+    result = -speed * trig(numpy.radians(direction))
+    result[direction > 360] = numpy.nan
+    result[_calm(direction) & ~numpy.isnan(speed)] = 0.0
+    return result
+
+
+@register('U', ('D', 'W'), 'Eastward wind component (m/s)')
+def wind_u(d, w):
+    return _apply(_wind_u, lambda d, w: _wind_component(d, w, numpy.sin), d, w)
+
+
+@register('V', ('D', 'W'), 'Northward wind component (m/s)')
+def wind_v(d, w):
+    return _apply(_wind_v, lambda d, w: _wind_component(d, w, numpy.cos), d, w)
+
+
+@register('W_KNOTS', ('W',), 'Wind speed (knots)')
+def wind_knots(w):
+    return _apply(lambda speed: speed / 0.514444, lambda speed: speed / 0.514444, w)
+
+
+# WI (wind speed indicator) codes for speeds measured with an anemometer,
+#  rather than estimated (0, 2, 3 and 6) or converted from Beaufort force (5)
+MEASURED = (1, 4, 7, 8)
+
+
+@register('W_MEASURED', ('WI',), 'Wind speed was measured, not estimated (1 or 0, from WI)')
+def wind_measured(wi):
+    return _apply(lambda indicator: 1 if int(indicator) in MEASURED else 0,
+                  lambda indicator: numpy.where(numpy.isin(indicator, MEASURED), 1.0,
+                                                numpy.where(numpy.isnan(indicator), numpy.nan, 0.0)),
+                  wi, kind=int)
+
+
+@register('W_ANEMOMETER', ('W', 'WI'), 'Wind speed (m/s), only where it was measured (from WI)')
+def wind_anemometer(w, wi):
+    return _apply(lambda speed, indicator: speed if int(indicator) in MEASURED else None,
+                  lambda speed, indicator: numpy.where(numpy.isin(indicator, MEASURED), speed, numpy.nan),
+                  w, wi)
+
+
+# Upper limits (m/s) of Beaufort forces 0-11
+BEAUFORT = (0.2, 1.5, 3.3, 5.4, 7.9, 10.7, 13.8, 17.1, 20.7, 24.4, 28.4, 32.6)
+
+
+def _beaufort(speed):
+    for force, limit in enumerate(BEAUFORT):
+        if speed <= limit:
+            return force
+    return 12
+
+
+@register('BEAUFORT', ('W',), 'Wind force (Beaufort scale)')
+def beaufort(w):
+    if numpy is None:
+        return _map(_beaufort, w)
+    w = numpy.asarray(w, dtype=float)
+    force = numpy.searchsorted(BEAUFORT, w).astype(float)
+    force[numpy.isnan(w)] = numpy.nan
+    return _to_list(force, int)
+
+
+# Humidity
+
+def _vapour_pressure(temperature):
+    # Saturation vapour pressure (hPa) over water (Magnus formula)
+    return 6.112 * math.exp(17.62 * temperature / (243.12 + temperature))
+
+
+def _vapour_pressures(temperature):
+    # Vector version of _vapour_pressure
+    return 6.112 * numpy.exp(17.62 * temperature / (243.12 + temperature))
+
+
+def _pressures(slp):
+    # SLP, with standard pressure where it is missing
+    return numpy.where(numpy.isnan(slp), 1013.25, slp)
+
+
+@register('E', ('DPT',), 'Vapour pressure (hPa)')
+def vapour_pressure(dpt):
+    return _apply(_vapour_pressure, _vapour_pressures, dpt)
+
+
+@register('RH', ('AT', 'DPT'), 'Relative humidity (%)')
+def relative_humidity(at, dpt):
+    return _apply(lambda t, td: 100.0 * _vapour_pressure(td) / _vapour_pressure(t),
+                  lambda t, td: 100.0 * _vapour_pressures(td) / _vapour_pressures(t),
+                  at, dpt)
+
+
+def _specific_humidity(td, pressure):
+    if pressure is None:
+        pressure = 1013.25
+    e = _vapour_pressure(td)
+    return 1000.0 * 0.622 * e / (pressure - 0.378 * e)
+
+
+def _specific_humidities(td, slp):
+    e = _vapour_pressures(td)
+    return 1000.0 * 0.622 * e / (_pressures(slp) - 0.378 * e)
+
+
+@register('Q', ('DPT', 'SLP'), 'Specific humidity (g/kg) - uses standard pressure if SLP is missing')
+def specific_humidity(dpt, slp):
+    if numpy is not None:
+        return _apply(None, _specific_humidities, dpt, slp)
+    return [None if td is None else _specific_humidity(td, p) for td, p in zip(dpt, slp)]
+
+
+def _wet_bulb_vapour_pressure(t, tw, pressure):
+    # Psychrometric equation for a ventilated psychrometer
+    if pressure is None:
+        pressure = 1013.25
+    return _vapour_pressure(tw) - 6.53e-4 * pressure * (t - tw)
+
+
+def _wet_bulb_relative_humidities(t, tw, slp):
+    e = _vapour_pressures(tw) - 6.53e-4 * _pressures(slp) * (t - tw)
+    return 100.0 * e / _vapour_pressures(t)
+
+
+@register('RH_WBT', ('AT', 'WBT', 'SLP'), 'Relative humidity (%) from the wet-bulb temperature')
+def relative_humidity_wet_bulb(at, wbt, slp):
+    if numpy is not None:
+        return _apply(None, _wet_bulb_relative_humidities, at, wbt, slp)
+    return [None if t is None or tw is None else
+            100.0 * _wet_bulb_vapour_pressure(t, tw, p) / _vapour_pressure(t)
+            for t, tw, p in zip(at, wbt, slp)]
+
+
+# Pressure
+
+# Standard gravity, and the coefficients of normal gravity at sea level
+#  as a function of latitude (m/s2)
+GRAVITY = 9.80665
+NORMAL_GRAVITY = (9.80616, 0.0026373, 0.0000059)
+
+
+def _gravity_ratio(latitude):
+    # Sea-level gravity at a latitude, as a fraction of standard gravity
+    g0, a, b = NORMAL_GRAVITY
+    c = math.cos(math.radians(2 * latitude))
+    return g0 * (1 - a * c + b * c * c) / GRAVITY
+
+
+def _gravity_ratios(latitude):
+    # Vector version of _gravity_ratio
+    g0, a, b = NORMAL_GRAVITY
+    c = numpy.cos(numpy.radians(2 * latitude))
+    return g0 * (1 - a * c + b * c * c) / GRAVITY
+
+
+@register('SLP_GC', ('SLP', 'LAT'),
+          'Sea-level pressure (hPa) corrected to standard gravity - for mercury barometer '
+          'readings not already corrected')
+def slp_gravity_corrected(slp, lat):
+    return _apply(lambda p, latitude: p * _gravity_ratio(latitude),
+                  lambda p, latitude: p * _gravity_ratios(latitude),
+                  slp, lat)
+
+
+def _tendency_sign(characteristic):
+    # A 0-3: pressure higher than 3 hours before, 4: the same, 5-8: lower
+    return 1 if characteristic < 4 else (0 if characteristic == 4 else -1)
+
+
+@register('SLP_3H', ('SLP', 'A', 'PPP'), 'Sea-level pressure (hPa) 3 hours before, from A and PPP')
+def slp_three_hours(slp, a, ppp):
+    return _apply(lambda p, characteristic, change: p - _tendency_sign(characteristic) * change,
+                  lambda p, characteristic, change: p - numpy.sign(4 - characteristic) * change,
+                  slp, a, ppp)
+
+
+# Unit conversions
+
+@register('AT_K', ('AT',), 'Air temperature (K)')
+def air_temperature_kelvin(at):
+    return _apply(lambda t: t + 273.15, lambda t: t + 273.15, at)
+
+
+@register('SST_K', ('SST',), 'Sea-surface temperature (K)')
+def sst_kelvin(sst):
+    return _apply(lambda t: t + 273.15, lambda t: t + 273.15, sst)
+
+
+@register('SLP_INHG', ('SLP',), 'Sea-level pressure (inches of mercury)')
+def slp_inches(slp):
+    return _apply(lambda p: p / 33.8639, lambda p: p / 33.8639, slp)
@@ -0,0 +1,179 @@
+# Compact storage of the base36 QC flags from the ICOADS attachment
+#  Each record's flags are held as one byte each in a packed array
+#  (one row per record), decoded from the record string with a single
+#  translate, rather than as separate Python ints in each record's data.
+
+import re
+
+from . import attachment_spans, get_offsets
+
+# The single-character base36 flags in the icoads attachment, in order on disc
+FLAGS = ('SQZ', 'SQA', 'AQZ', 'AQA', 'UQZ', 'UQA', 'VQZ', 'VQA', 'PQZ', 'PQA', 'DQZ', 'DQA',
+         'SF', 'AF', 'UF', 'VF', 'PF', 'RF',
+         'ZNC', 'WNC', 'BNC', 'XNC', 'YNC', 'PNC', 'ANC', 'GNC', 'DNC', 'SNC', 'CNC', 'ENC',
+         'FNC', 'TNC')
+
+# Value stored for a blank (missing) or invalid flag
+MISSING = 255
+
+# Byte translation table: base36 digit -> its value, anything else -> MISSING
+_TABLE = bytearray([MISSING] * 256)
+for _i, _c in enumerate('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'):
+    _TABLE[ord(_c)] = _i
+_TABLE = bytes(_TABLE)
+
+
+def _runs(attachment, params):
+    # Contiguous (start, end) ranges of the params within the attachment
+    offsets = get_offsets(attachment)
+    runs = []
+    for p in params:
+        offset, length = offsets[p]
+        if runs and runs[-1][1] == offset:
+            runs[-1][1] = offset + length
+        else:
+            runs.append([offset, offset + length])
+    return [tuple(run) for run in runs]
+
+
+class FlagVector(object):
+    """
+    The QC flags of a set of records, packed one byte per flag
+
+    Row i holds the flags of record i, in the order of FLAGS; blank flags are MISSING.
+    """
+
+    def __init__(self, params=FLAGS):
+        """
+        :param params: The flags to keep (a subset of FLAGS)
+        :type params: sequence of str
+        """
+        self.params = tuple(params)
+        self.width = len(self.params)
+        self.index = dict((p, i) for i, p in enumerate(self.params))
+        self.data = bytearray()
+        self._runs = _runs(1, self.params)
+        self._blank = bytes([MISSING]) * self.width
+
+    def __len__(self):
+        return len(self.data) // self.width
+
+    def append(self, line):
+        """
+        Add the flags from the string representation of a record
+
+        :param line: The record, as in the file
+        :type line: str
+        """
+        line = line.rstrip('\n')
+        for attachment, start, end in attachment_spans(line):
+            if attachment == 1:
+                raw = line[start:end].encode('latin-1')
+                raw += b' ' * (end - start - len(raw))
+                for run_start, run_end in self._runs:
+                    self.data += raw[run_start:run_end].translate(_TABLE)
+                return
+        self.data += self._blank
+
+    def append_record(self, record):
+        """
+        Add the flags from a decoded IMMA record
+
+        :param record: The record
+        :type record: IMMA
+        """
+        for p in self.params:
+            value = record.data.get(p)
+            self.data.append(MISSING if value is None or value < 0 else value)
+
+    @classmethod
+    def from_file(cls, fh, params=FLAGS):
+        """
+        Read the flags of all the records in a file
+
+        :param fh: The filehandle
+        :type fh: file handle
+
+        :return: FlagVector
+        """
+        flags = cls(params)
+        for line in fh:
+            if len(line.strip()) > 0:
+                flags.append(line)
+        return flags
+
+    def nbytes(self):
+        """
+        :return: Memory used by the flag values
+        :rtype: int
+        """
+        return len(self.data)
+
+    def column(self, name):
+        """
+        :param name: The flag
+        :type name: str
+
+        :return: The value of the flag for each record
+        :rtype: bytes
+        """
+        return bytes(self.data[self.index[name]::self.width])
+
+    def row(self, i):
+        """
+        :param i: Record number
+        :type i: int
+
+        :return: Flag values for one record (None for missing)
+        :rtype: dict
+        """
+        values = self.data[i * self.width:(i + 1) * self.width]
+        return dict((p, None if v == MISSING else v) for p, v in zip(self.params, values))
+
+    def mask(self, name, values):
+        """
+        :param name: The flag
+        :type name: str
+        :param values: The flag values wanted
+        :type values: iterable of int
+
+        :return: 1 for each record whose flag is in values, 0 otherwise
+        :rtype: bytes
+        """
+        table = bytearray(256)
+        for value in values:
+            table[value] = 1
+        return self.column(name).translate(bytes(table))
+
+    def where(self, **conditions):
+        """
+        Find the records whose flags have given values - e.g. where(SF={2, 3}, AF={1})
+
+        :return: Numbers of the records meeting all the conditions
+        :rtype: list
+        """
+        n = len(self)
+        combined = None
+        for name, values in conditions.items():
+            mask = int.from_bytes(self.mask(name, values), 'little')
+            combined = mask if combined is None else combined & mask
+        if combined is None:
+            return list(range(n))
+        return [match.start() for match in re.finditer(b'\x01', combined.to_bytes(n, 'little'))]
+
+    def count(self, **conditions):
+        """
+        :return: Number of records meeting all the conditions (as for where)
+        :rtype: int
+        """
+        return len(self.where(**conditions))
+
+    def as_array(self):
+        """
+        The flags as a numpy array (needs numpy)
+
+        :return: Array of shape (records, flags), sharing memory with this object
+        :rtype: numpy.ndarray of uint8
+        """
+        import numpy
+        return numpy.frombuffer(self.data, dtype=numpy.uint8).reshape(len(self), self.width)
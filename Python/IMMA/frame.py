@@ -0,0 +1,112 @@
+# Read IMMA files into pandas DataFrames
+#  Columns are built directly from the decoded values, with a dtype for
+#  each parameter taken from its definition: nullable integers for codes,
+#  floats for scaled measurements, categories for ID and C1.
+#  Needs pandas (which this module imports - the rest of IMMA doesn't).
+
+import itertools
+
+import pandas
+
+from . import definitions, open_file, parameters, records
+
+# Character parameters stored as categories (few distinct values, many repeats)
+CATEGORICAL = ('ID', 'C1', 'C1M', 'CCCC', 'BUID')
+
+
+def dtype(p):
+    """
+    The DataFrame dtype used for a parameter
+
+    :param p: The parameter
+    :type p: str
+
+    :return: 'Int32' for integer codes and base36, 'float64' for scaled values,
+        'category' for ID, C1 and similar, 'string' for other characters
+    :rtype: str
+    """
+    if p in CATEGORICAL:
+        return 'category'
+    for attachment in sorted(definitions):
+        if p in definitions[attachment]:
+            scale, encoding = definitions[attachment][p][5], definitions[attachment][p][6]
+            if encoding == 3:
+                return 'string'
+            if scale is not None and scale != 1.0:
+                return 'float64'
+            return 'Int32'
+    return 'object'
+
+
+def _column(values, p):
+    kind = dtype(p)
+    if kind == 'category':
+        return pandas.Categorical(values)
+    if kind == 'float64':
+        return pandas.array([float('nan') if v is None else v for v in values], dtype='float64')
+    return pandas.array(values, dtype=kind)
+
+
+def _frame(records, params, start):
+    columns = {}
+    if params is not None:
+        for p in params:
+            columns[p] = []
+    seen = []  # Attachments seen, to find the parameters when params is None
+    n = 0
+    for record in records:
+        if params is None:
+            for attachment in record.attachments:
+                if attachment not in seen:
+                    seen.append(attachment)
+                    for p in parameters['%02d' % attachment]:
+                        if p not in columns:
+                            columns[p] = [None] * n
+        for p, values in columns.items():
+            values.append(record.data.get(p))
+        n += 1
+    return pandas.DataFrame(dict((p, _column(values, p)) for p, values in columns.items()),
+                            index=pandas.RangeIndex(start, start + n))
+
+
+def to_dataframe(path, params=None, chunksize=None, where=None):
+    """
+    Read an IMMA file into a pandas DataFrame
+
+    :param path: The IMMA file (gzip compressed if the name ends in .gz), or an open filehandle
+    :type path: str or file handle
+    :param params: Parameters to read (default is all those in the attachments
+        present - which can differ between chunks)
+    :type params: list
+    :param chunksize: If given, return an iterator over DataFrames of up to
+        this many records, for files too large to read at once
+    :type chunksize: int
+    :param where: Only use records for which where(record) is true
+    :type where: callable
+
+    :return: DataFrame, one row per record - or an iterator of DataFrames if chunksize is given
+    """
+    if chunksize is None:
+        fh = open_file(path) if isinstance(path, str) else path
+        try:
+            return _frame(records(fh, params, where, reuse=True), params, 0)
+        finally:
+            if fh is not path:
+                fh.close()
+    return _chunks(path, params, chunksize, where)
+
+
+def _chunks(path, params, chunksize, where):
+    fh = open_file(path) if isinstance(path, str) else path
+    try:
+        source = records(fh, params, where, reuse=True)
+        start = 0
+        while True:
+            frame = _frame(itertools.islice(source, chunksize), params, start)
+            if len(frame) == 0:
+                return
+            start += len(frame)
+            yield frame
+    finally:
+        if fh is not path:
+            fh.close()
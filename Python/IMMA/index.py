@@ -0,0 +1,119 @@
+# Line-offset indexes for IMMA files
+#  The byte offset of the start of each record, so records can be read
+#  by position (seek) without reading everything before them.
+
+import array
+import os
+
+from . import open_file
+
+
+def line_offsets(filename):
+    """
+    Find the byte offset of each record in a file
+
+    :param filename: The IMMA file
+    :type filename: str
+
+    :return: Offsets of the non-blank lines in the file
+    :rtype: array.array of unsigned long long
+    """
+    result = array.array('Q')
+    offset = 0
+    with open_file(filename, 'rb') as fh:
+        for raw in fh:
+            if len(raw.strip()) > 0:
+                result.append(offset)
+            offset += len(raw)
+    return result
+
+
+def index_filename(filename, directory=None):
+    """
+    :param filename: The IMMA file
+    :type filename: str
+    :param directory: Directory for index files (default is the IMMA file's own
+        directory) - for data that can't be written to
+    :type directory: str
+
+    :return: Name of the file holding the index for an IMMA file
+    :rtype: str
+    """
+    if directory is not None:
+        return os.path.join(directory, '%s.idx' % os.path.basename(filename))
+    return '%s.idx' % filename
+
+
+def save_offsets(offsets, filename):
+    """
+    Write an index to disc
+
+    :param offsets: Offsets from line_offsets
+    :type offsets: array.array
+    :param filename: File to write them to
+    :type filename: str
+    """
+    with open(filename, 'wb') as fh:
+        offsets.tofile(fh)
+
+
+def load_offsets(filename):
+    """
+    Read an index written by save_offsets
+
+    :param filename: File to read the index from
+    :type filename: str
+
+    :return: Offsets, as from line_offsets
+    :rtype: array.array
+    """
+    result = array.array('Q')
+    with open(filename, 'rb') as fh:
+        result.frombytes(fh.read())
+    return result
+
+
+def load_index(filename, build=True, directory=None):
+    """
+    Get the index for an IMMA file, from its .idx file if that is up to date
+
+    :param filename: The IMMA file
+    :type filename: str
+    :param build: Make (and save) the index if there isn't an up-to-date one
+    :type build: bool
+    :param directory: Directory for index files (see index_filename)
+    :type directory: str
+
+    :return: Offsets, as from line_offsets (None if there's no index and build is false)
+    :rtype: array.array
+    """
+    idx = index_filename(filename, directory)
+    if os.path.exists(idx) and os.path.getmtime(idx) >= os.path.getmtime(filename):
+        return load_offsets(idx)
+    if not build:
+        return None
+    offsets = line_offsets(filename)
+    try:
+        save_offsets(offsets, idx)
+    except OSError:  # Read-only - the index is made again next time
+        pass
+    return offsets
+
+
+def read_lines(filename, offsets, positions):
+    """
+    Read selected lines from a file
+
+    :param filename: The IMMA file
+    :type filename: str
+    :param offsets: Offsets, as from line_offsets
+    :type offsets: array.array
+    :param positions: Record numbers (0 is the first record) of the lines wanted
+    :type positions: iterable of int
+
+    :return: generator of (position, line)
+    """
+    with open_file(filename, 'rb') as fh:
+        for position in sorted(positions):
+            fh.seek(offsets[position])
+            yield position, fh.readline().decode('latin-1')
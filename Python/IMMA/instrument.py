@@ -0,0 +1,230 @@
+# Optional instrumentation of IMMA decoding
+#  When enabled, IMMA.read and IMMA.decode, and the partial decoding used by
+#  peek and read_into(record, line, params), are replaced by versions that
+#  count and time what they do; disabling puts the originals back, so
+#  there is no cost at all when instrumentation is off.
+#
+#  Only decoding in this process is seen: work done in worker processes
+#  (IMMADataset, parallel_columns, the imma command, BlockDecoder with
+#  processes=True) isn't counted, and nor are the QC flags FlagVector
+#  takes straight from the record strings.
+
+import re
+import sys
+import threading
+import time
+
+from . import IMMA
+
+_package = sys.modules[__package__]
+
+_original_read = IMMA.read
+_original_decode = IMMA.decode
+_original_decode_params = _package._decode_params
+
+# The Instrumentation currently enabled (only one can be)
+_active = None
+
+
+class Instrumentation(object):
+    """
+    Counters and timers for IMMA decoding
+
+    Usage::
+
+        stats = Instrumentation(interval=100000)
+        stats.add_hook(my_metrics_callback)
+        with stats:
+            for record in IMMA.records(fh):
+                ...
+        print(stats.stats())
+    """
+
+    def __init__(self, interval=None):
+        """
+        :param interval: Call the hooks every this many records (as well as on report)
+        :type interval: int
+        """
+        self.interval = interval
+        self.hooks = []
+        self.lock = threading.Lock()  # Records may be decoded in several threads
+        self.reset()
+
+    def reset(self):
+        """
+        Set all the counters to zero
+        """
+        self.records = 0  # Records read
+        self.bytes = 0  # Characters read
+        self.read_time = 0.0  # Seconds spent in IMMA.read
+        self.errors = {}  # Exception type name -> count
+        self.attachment_count = {}  # Attachment name -> number decoded
+        self.attachment_time = {}  # Attachment name -> seconds spent decoding
+        self.parse_failures = {}  # Parameter -> count of non-blank values decoded as None
+        self.peeks = 0  # Lines partly decoded (peek, or read_into with params)
+        self.peek_bytes = 0
+        self.peek_time = 0.0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0  # Seconds enabled, before the current period
+
+    def add_hook(self, callback):
+        """
+        Add a function to be called with the stats dictionary
+
+        :param callback: Called as callback(stats)
+        :type callback: callable
+        """
+        self.hooks.append(callback)
+
+    def remove_hook(self, callback):
+        self.hooks.remove(callback)
+
+    def enable(self):
+        """
+        Start instrumenting IMMA.read, IMMA.decode and peek
+        """
+        global _active
+        if _active is self:
+            return
+        if _active is not None:
+            raise Exception("IMMA instrumentation is already enabled")
+        _active = self
+        self.started = time.perf_counter()
+        IMMA.read = _make_read(self)
+        IMMA.decode = _make_decode(self)
+        _package._decode_params = _make_decode_params(self)
+
+    def disable(self):
+        """
+        Stop instrumenting, and restore the original IMMA.read, IMMA.decode and peek
+        """
+        global _active
+        if _active is not self:
+            return
+        IMMA.read = _original_read
+        IMMA.decode = _original_decode
+        _package._decode_params = _original_decode_params
+        _active = None
+        self.elapsed += time.perf_counter() - self.started
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *args):
+        self.disable()
+        self.report()
+
+    def stats(self):
+        """
+        :return: The current counts, times and rates
+        :rtype: dict
+        """
+        with self.lock:
+            elapsed = self.elapsed
+            if _active is self:
+                elapsed += time.perf_counter() - self.started
+            return {'records': self.records,
+                    'bytes': self.bytes,
+                    'elapsed': elapsed,
+                    'records_per_second': self.records / elapsed if elapsed > 0 else None,
+                    'bytes_per_second': self.bytes / elapsed if elapsed > 0 else None,
+                    'read_seconds': self.read_time,
+                    'other_seconds': elapsed - self.read_time - self.peek_time,  # I/O and the caller's own work
+                    'attachments': dict((name, {'count': self.attachment_count[name],
+                                                'seconds': self.attachment_time[name]})
+                                        for name in self.attachment_count),
+                    'peeks': {'count': self.peeks, 'bytes': self.peek_bytes, 'seconds': self.peek_time},
+                    'parse_failures': dict(self.parse_failures),
+                    'errors': dict(self.errors)}
+
+    def report(self):
+        """
+        Call the hooks with the current stats
+        """
+        stats = self.stats()
+        for hook in self.hooks:
+            hook(stats)
+        return stats
+
+
+def _make_read(instrumentation):
+    perf_counter = time.perf_counter
+
+    def read(self, line):
+        start = perf_counter()
+        error = None
+        try:
+            return _original_read(self, line)
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            with instrumentation.lock:
+                instrumentation.read_time += perf_counter() - start
+                instrumentation.records += 1
+                instrumentation.bytes += len(line)
+                if error is not None:
+                    instrumentation.errors[error] = instrumentation.errors.get(error, 0) + 1
+                due = (instrumentation.interval is not None and
+                       instrumentation.records % instrumentation.interval == 0)
+            if due:
+                instrumentation.report()
+
+    read.__doc__ = _original_read.__doc__
+    return read
+
+
+def _make_decode(instrumentation):
+    perf_counter = time.perf_counter
+
+    def decode(self, as_string, attachment, parameters, definitions):
+        start = perf_counter()
+        try:
+            return _original_decode(self, as_string, attachment, parameters, definitions)
+        finally:
+            elapsed = perf_counter() - start
+            failures = {}
+            if as_string is not None:
+                _count_failures(failures, self, as_string, parameters, definitions)
+            with instrumentation.lock:
+                instrumentation.attachment_time[attachment] = (
+                    instrumentation.attachment_time.get(attachment, 0.0) + elapsed)
+                instrumentation.attachment_count[attachment] = (
+                    instrumentation.attachment_count.get(attachment, 0) + 1)
+                for p, count in failures.items():
+                    instrumentation.parse_failures[p] = instrumentation.parse_failures.get(p, 0) + count
+
+    decode.__doc__ = _original_decode.__doc__
+    return decode
+
+
+def _make_decode_params(instrumentation):
+    perf_counter = time.perf_counter
+
+    def decode_params(line, spans, params, result):
+        start = perf_counter()
+        try:
+            return _original_decode_params(line, spans, params, result)
+        finally:
+            elapsed = perf_counter() - start
+            with instrumentation.lock:
+                instrumentation.peeks += 1
+                instrumentation.peek_bytes += len(line)
+                instrumentation.peek_time += elapsed
+
+    return decode_params
+
+
+def _count_failures(failures, record, as_string, parameters, definitions):
+    # Count the parameters set to None although their string wasn't blank
+    position = 0
+    for p in parameters:
+        length = definitions[p][0]
+        if length is None:
+            value = as_string[position:]
+        else:
+            value = as_string[position:position + length]
+            position += length
+        if record.data.get(p) is None and re.search(r'\S', value) is not None:
+            failures[p] = failures.get(p, 0) + 1
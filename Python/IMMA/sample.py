@@ -0,0 +1,89 @@
+# Random samples of the records in an IMMA file
+#  Choose the records first and decode only those chosen. Strata are found
+#  by decoding just the parameters they depend on.
+
+import random
+
+from . import IMMA, open_file, peek
+from .index import read_lines
+
+
+def _decode(line):
+    record = IMMA()
+    record.read(line)
+    return record
+
+
+def sample(filename, n, by=None, key=None, offsets=None, seed=None):
+    """
+    Draw a uniform random sample of the records in a file
+
+    With an index (offsets) the sample is drawn from the record positions
+    and only the chosen lines are read. Otherwise the file is read once,
+    keeping a reservoir of n lines, and only the lines left in the
+    reservoir at the end are decoded.
+
+    With by, the sample is stratified: up to n records are drawn from each
+    stratum. This needs every line to be read (but only the parameters
+    in by are decoded), so the index is not used.
+
+    :param filename: The IMMA file
+    :type filename: str
+    :param n: Sample size (per stratum if by is given)
+    :type n: int
+    :param by: Parameters defining the strata (e.g. ['YR', 'DCK'])
+    :type by: list
+    :param key: Function of the dictionary of by parameter values giving the
+        stratum (default is the tuple of values in the order of by) - e.g.
+        lambda v: (v['YR'] // 10 if v['YR'] is not None else None, v['DCK'])
+        for decade and deck (missing values are None)
+    :type key: callable
+    :param offsets: Index of the file, from IMMA.index.line_offsets or load_index
+    :type offsets: array.array
+    :param seed: Seed for the random number generator
+    :type seed: int
+
+    :return: The sampled records, in file order - or, if by is given,
+        a dictionary of stratum -> list of records
+    """
+    rng = random.Random(seed)
+
+    if by is None:
+        if offsets is not None:
+            positions = rng.sample(range(len(offsets)), min(n, len(offsets)))
+            return [_decode(line) for position, line in read_lines(filename, offsets, positions)]
+        reservoir = _reservoir(filename, n, rng, None)[None]
+        return [_decode(line) for position, line in sorted(reservoir)]
+
+    if key is None:
+        key = lambda values: tuple(values[p] for p in by)
+    reservoirs = _reservoir(filename, n, rng, lambda line: key(peek(line, by)))
+    return dict((stratum, [_decode(line) for position, line in sorted(reservoir)])
+                for stratum, reservoir in reservoirs.items())
+
+
+def _reservoir(filename, n, rng, stratum):
+    # Single-pass reservoir sample (Algorithm R) of (position, line),
+    #  one reservoir for each stratum
+    reservoirs = {}
+    seen = {}
+    position = 0
+    with open_file(filename) as fh:
+        for line in fh:
+            if len(line.strip()) == 0:
+                continue
+            s = stratum(line) if stratum is not None else None
+            if s not in reservoirs:
+                reservoirs[s] = []
+                seen[s] = 0
+            seen[s] += 1
+            if len(reservoirs[s]) < n:
+                reservoirs[s].append((position, line))
+            else:
+                j = rng.randrange(seen[s])
+                if j < n:
+                    reservoirs[s][j] = (position, line)
+            position += 1
+    if stratum is None and None not in reservoirs:
+        reservoirs[None] = []
+    return reservoirs
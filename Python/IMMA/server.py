@@ -0,0 +1,675 @@
+# Local query server for a set of indexed IMMA files
+#  Each file is split into blocks of records, found through its line-offset
+#  index; a summary of each block (latitude, longitude and time ranges,
+#  and ship IDs) says which blocks a query needs to look at. Decoded
+#  blocks are kept in a least-recently-used cache, so repeated queries for
+#  the same region or period don't decode the same lines again.
+#
+#  Requests are served over HTTP (TCP or a Unix socket) by a fixed pool of
+#  worker threads:
+#
+#    GET /records?box=LAT0,LAT1,LON0,LON1&start=1850-01-01&end=1850-02-01
+#                &id=SHIP&params=YR,MO,DY,SST&limit=1000&format=json
+#    GET /stats    cache hits, misses and size
+#    GET /files    the files served, with their numbers of records and blocks
+
+import collections
+import concurrent.futures
+import datetime
+import json
+import os
+import socketserver
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from . import IMMA, open_file, peek
+from .index import index_filename, line_offsets, load_index, save_offsets
+from .tracks import EPOCH, record_time
+
+# Records in each block
+BLOCK_SIZE = 1000
+
+# Parameters needed for the block summaries
+SUMMARY_PARAMS = ('YR', 'MO', 'DY', 'HR', 'LAT', 'LON', 'ID')
+
+
+def summary_filename(filename, directory=None):
+    """
+    :param filename: The IMMA file
+    :type filename: str
+    :param directory: Directory for summary files (default is the IMMA file's own
+        directory) - for data that can't be written to
+    :type directory: str
+
+    :return: Name of the file holding the block summaries for an IMMA file
+    :rtype: str
+    """
+    if directory is not None:
+        return os.path.join(directory, '%s.blocks' % os.path.basename(filename))
+    return '%s.blocks' % filename
+
+
+def _longitude(lon):
+    # Longitudes in the range 0-360
+    return lon % 360.0
+
+
+def summarise(filename, offsets, block_size=BLOCK_SIZE):
+    """
+    Summarise the blocks of a file
+
+    :param filename: The IMMA file
+    :type filename: str
+    :param offsets: Its index, from index.load_index
+    :type offsets: array.array
+    :param block_size: Records in each block
+    :type block_size: int
+
+    :return: For each block, a dict with lat, lon and time ([min, max], or
+        None if no record has a value) and ids (list of ship IDs)
+    :rtype: list
+    """
+    result = []
+    with open_file(filename) as fh:
+        block = None
+        n = 0
+        for line in fh:
+            if len(line.strip()) == 0:
+                continue
+            if n % block_size == 0:
+                block = {'lat': None, 'lon': None, 'time': None, 'ids': set()}
+                result.append(block)
+            n += 1
+            values = peek(line, SUMMARY_PARAMS)
+            if values['LAT'] is not None and values['LON'] is not None:
+                for name, value in (('lat', values['LAT']), ('lon', _longitude(values['LON']))):
+                    if block[name] is None:
+                        block[name] = [value, value]
+                    else:
+                        block[name] = [min(block[name][0], value), max(block[name][1], value)]
+            time = record_time(values)
+            if time is not None:
+                if block['time'] is None:
+                    block['time'] = [time, time]
+                else:
+                    block['time'] = [min(block['time'][0], time), max(block['time'][1], time)]
+            if values['ID'] is not None:
+                block['ids'].add(values['ID'].strip())
+    if n != len(offsets):
+        raise Exception("Index of %s is out of date" % filename)
+    for block in result:
+        block['ids'] = sorted(block['ids'])
+    return result
+
+
+def save_summary(filename, offsets, blocks, block_size=BLOCK_SIZE, directory=None):
+    """
+    Write the block summaries for an IMMA file to its .blocks file (if it can be written)
+    """
+    try:
+        with open(summary_filename(filename, directory), 'w') as fh:
+            json.dump({'block_size': block_size, 'records': len(offsets), 'blocks': blocks}, fh)
+    except OSError:  # Read-only - the summaries are made again next time
+        pass
+
+
+def load_summary(filename, offsets, block_size=BLOCK_SIZE, directory=None):
+    """
+    Get the block summaries for an IMMA file, from its .blocks file if that is up to date
+
+    :param directory: Directory for summary files (see summary_filename)
+    :type directory: str
+
+    :return: As from summarise (the summaries are made and saved if need be)
+    :rtype: list
+    """
+    stored = summary_filename(filename, directory)
+    if os.path.exists(stored) and os.path.getmtime(stored) >= os.path.getmtime(filename):
+        with open(stored) as fh:
+            summary = json.load(fh)
+        if summary['block_size'] == block_size and summary['records'] == len(offsets):
+            return summary['blocks']
+    blocks = summarise(filename, offsets, block_size)
+    save_summary(filename, offsets, blocks, block_size, directory)
+    return blocks
+
+
+class Query(object):
+    """
+    Selection of records by region, period and ship
+    """
+
+    def __init__(self, box=None, start=None, end=None, id=None):
+        """
+        :param box: (lat0, lat1, lon0, lon1) - a longitude range with lon0 > lon1
+            crosses the date line
+        :type box: tuple
+        :param start: Earliest time (hours since 1970, as from tracks.record_time)
+        :type start: float
+        :param end: Time to stop before
+        :type end: float
+        :param id: Ship ID
+        :type id: str
+        """
+        self.box = box
+        if box is not None:
+            if box[3] - box[2] >= 360.0:  # All longitudes
+                self.box = (box[0], box[1], 0.0, 360.0)
+            else:
+                self.box = (box[0], box[1], _longitude(box[2]), _longitude(box[3]))
+        self.start = start
+        self.end = end
+        self.id = id.strip() if id is not None else None
+
+    def _lon_ranges(self):
+        lon0, lon1 = self.box[2], self.box[3]
+        if lon0 <= lon1:
+            return [(lon0, lon1)]
+        return [(lon0, 360.0), (0.0, lon1)]
+
+    def block(self, summary):
+        """
+        :param summary: Summary of a block, from summarise
+        :type summary: dict
+
+        :return: Whether the block could hold records matching the query
+        :rtype: bool
+        """
+        if self.box is not None:
+            if summary['lat'] is None:
+                return False
+            if summary['lat'][1] < self.box[0] or summary['lat'][0] > self.box[1]:
+                return False
+            if not any(summary['lon'][1] >= lon0 and summary['lon'][0] <= lon1
+                       for lon0, lon1 in self._lon_ranges()):
+                return False
+        if self.start is not None or self.end is not None:
+            if summary['time'] is None:
+                return False
+            if self.start is not None and summary['time'][1] < self.start:
+                return False
+            if self.end is not None and summary['time'][0] >= self.end:
+                return False
+        if self.id is not None and self.id not in summary['ids']:
+            return False
+        return True
+
+    def __call__(self, record, time):
+        """
+        :param record: A decoded record
+        :type record: IMMA
+        :param time: Its time, from tracks.record_time
+
+        :return: Whether the record matches the query
+        :rtype: bool
+        """
+        if self.box is not None:
+            lat, lon = record['LAT'], record['LON']
+            if lat is None or lon is None or lat < self.box[0] or lat > self.box[1]:
+                return False
+            lon = _longitude(lon)
+            if not any(lon0 <= lon <= lon1 for lon0, lon1 in self._lon_ranges()):
+                return False
+        if self.start is not None and (time is None or time < self.start):
+            return False
+        if self.end is not None and (time is None or time >= self.end):
+            return False
+        if self.id is not None and (record['ID'] is None or record['ID'].strip() != self.id):
+            return False
+        return True
+
+
+class BlockCache(object):
+    """
+    Least-recently-used cache of decoded blocks, bounded by the number of records held
+
+    Safe to use from several threads: a block being decoded for one thread
+    is waited for, not decoded again, by the others.
+    """
+
+    def __init__(self, max_records=1000000):
+        """
+        :param max_records: Most records to hold (the memory used is about this
+            times the memory per record reported by benchmarks/run.py)
+        :type max_records: int
+        """
+        self.max_records = max_records
+        self.blocks = collections.OrderedDict()  # key -> list of records, least recently used first
+        self.loading = {}  # key -> Future, for blocks being decoded
+        self.records = 0
+        self.hits = 0
+        self.misses = 0  # Blocks decoded
+        self.waits = 0  # Blocks waited for while another thread decoded them
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, load):
+        """
+        Get a block, decoding it if it isn't in the cache
+
+        :param key: Identifies the block
+        :param load: Called with no arguments to decode the block if need be
+        :type load: callable
+
+        :return: The block (a list)
+        """
+        with self.lock:
+            if key in self.blocks:
+                self.blocks.move_to_end(key)
+                self.hits += 1
+                return self.blocks[key]
+            future = self.loading.get(key)
+            if future is None:
+                future = concurrent.futures.Future()
+                self.loading[key] = future
+                self.misses += 1
+                loader = True
+            else:
+                self.waits += 1
+                loader = False
+        if not loader:
+            return future.result()
+        try:
+            block = load()
+        except Exception as e:
+            with self.lock:
+                del self.loading[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            del self.loading[key]
+            if len(block) <= self.max_records:
+                self.blocks[key] = block
+                self.records += len(block)
+                while self.records > self.max_records:
+                    old_key, old_block = self.blocks.popitem(last=False)
+                    self.records -= len(old_block)
+                    self.evictions += 1
+        future.set_result(block)
+        return block
+
+    def clear(self):
+        with self.lock:
+            self.blocks.clear()
+            self.records = 0
+
+    def remove(self, key):
+        """
+        Drop a block from the cache, if it's there
+        """
+        with self.lock:
+            block = self.blocks.pop(key, None)
+            if block is not None:
+                self.records -= len(block)
+
+    def stats(self):
+        """
+        :return: hits, misses, waits, evictions, hit_rate, blocks and records held, max_records
+        :rtype: dict
+        """
+        with self.lock:
+            total = self.hits + self.misses + self.waits
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'waits': self.waits,
+                    'evictions': self.evictions,
+                    'hit_rate': self.hits / total if total > 0 else None,
+                    'blocks': len(self.blocks),
+                    'records': self.records,
+                    'max_records': self.max_records}
+
+
+def _stamp(filename):
+    # Size and modification time, to tell if a file has changed
+    status = os.stat(filename)
+    return (status.st_size, status.st_mtime_ns)
+
+
+class FileSet(object):
+    """
+    A set of indexed IMMA files, queried a block at a time through a BlockCache
+
+    Files may change while they are served: when a query reaches a file,
+    and each time a block has to be decoded, a file whose size or
+    modification time has changed gets a new index and block summaries
+    (and its cached blocks are dropped).
+    """
+
+    def __init__(self, files, block_size=BLOCK_SIZE, cache=None, directory=None):
+        """
+        :param files: The IMMA files (indexes and block summaries are made if need be)
+        :type files: sequence of str
+        :param block_size: Records in each block
+        :type block_size: int
+        :param cache: Cache for decoded blocks (default is a new BlockCache)
+        :type cache: BlockCache
+        :param directory: Directory for the index and summary files (default is
+            alongside each IMMA file) - for data that can't be written to
+        :type directory: str
+        """
+        self.files = list(files)
+        self.block_size = block_size
+        self.cache = cache if cache is not None else BlockCache()
+        self.directory = directory
+        self.offsets = []  # Index of each file
+        self.summaries = []  # Block summaries of each file
+        self.stamps = []  # Size and modification time of each file when indexed
+        self.generations = []  # Times each file has been indexed again (part of the cache keys)
+        self.lock = threading.Lock()
+        for filename in self.files:
+            self.stamps.append(_stamp(filename))
+            self.generations.append(0)
+            offsets = load_index(filename, directory=directory)
+            self.offsets.append(offsets)
+            self.summaries.append(load_summary(filename, offsets, block_size, directory))
+
+    def _refresh(self, number):
+        # Index and summarise a file again if it has changed since it was indexed
+        filename = self.files[number]
+        with self.lock:
+            stamp = _stamp(filename)
+            if stamp == self.stamps[number]:
+                return
+            offsets = line_offsets(filename)
+            try:
+                save_offsets(offsets, index_filename(filename, self.directory))
+            except OSError:  # Read-only - the index is made again next time
+                pass
+            summary = summarise(filename, offsets, self.block_size)
+            save_summary(filename, offsets, summary, self.block_size, self.directory)
+            old = (self.generations[number], len(self.summaries[number]))
+            self.offsets[number] = offsets
+            self.summaries[number] = summary
+            self.stamps[number] = stamp
+            self.generations[number] += 1
+        for block in range(old[1]):
+            self.cache.remove((number, old[0], block))
+
+    def _load(self, number, block):
+        # Decode a block, keeping the time of each record for the queries
+        self._refresh(number)
+        offsets = self.offsets[number]
+        first = block * self.block_size
+        n = min(self.block_size, len(offsets) - first)
+        result = []
+        if n <= 0:  # The file has shrunk
+            return result
+        with open_file(self.files[number], 'rb') as fh:
+            fh.seek(offsets[first])
+            while len(result) < n:
+                line = fh.readline()
+                if len(line) == 0:
+                    raise Exception("%s ends before record %d of its index - the file has changed" %
+                                    (self.files[number], first + len(result)))
+                line = line.decode('latin-1')
+                if len(line.strip()) == 0:
+                    continue
+                record = IMMA()
+                record.read(line)
+                result.append((record, record_time(record)))
+        return result
+
+    def block(self, number, block):
+        """
+        :param number: Position of the file in files
+        :type number: int
+        :param block: Block number within the file
+        :type block: int
+
+        :return: The decoded block - list of (IMMA record, time)
+        :rtype: list
+        """
+        key = (number, self.generations[number], block)
+        result = self.cache.get(key, lambda: self._load(number, block))
+        if self.generations[number] != key[1]:  # Indexed again while loading
+            self.cache.remove(key)
+        return result
+
+    def query(self, query, limit=None):
+        """
+        Find the records matching a query
+
+        :param query: The query
+        :type query: Query
+        :param limit: Stop after this many records
+        :type limit: int
+
+        :return: generator of IMMA records, in file order
+        """
+        n = 0
+        for number in range(len(self.files)):
+            self._refresh(number)
+            for block, block_summary in enumerate(self.summaries[number]):
+                if not query.block(block_summary):
+                    continue
+                for record, time in self.block(number, block):
+                    if not query(record, time):
+                        continue
+                    if limit is not None and n >= limit:
+                        return
+                    n += 1
+                    yield record
+
+    def describe(self):
+        """
+        :return: For each file, its name and numbers of records and blocks
+        :rtype: list
+        """
+        return [{'file': filename, 'records': len(offsets), 'blocks': len(summary)}
+                for filename, offsets, summary in zip(self.files, self.offsets, self.summaries)]
+
+
+def _time(text):
+    # Hours since 1970 from an ISO date ('1850-01-01' or '1850-01-01T12:00')
+    return (datetime.datetime.fromisoformat(text) - EPOCH).total_seconds() / 3600.0
+
+
+def parse_query(fields):
+    """
+    Make a Query from the fields of a request
+
+    :param fields: Field name -> value (box, start, end, id)
+    :type fields: dict
+
+    :return: Query
+    """
+    box = None
+    if fields.get('box'):
+        box = tuple(float(x) for x in fields['box'].split(','))
+        if len(box) != 4:
+            raise ValueError("box must be lat0,lat1,lon0,lon1")
+    return Query(box=box,
+                 start=_time(fields['start']) if fields.get('start') else None,
+                 end=_time(fields['end']) if fields.get('end') else None,
+                 id=fields.get('id') or None)
+
+
+def to_json(records, params):
+    """
+    :return: The records as JSON - {"count": n, "records": [{parameter: value, ...}, ...]}
+    :rtype: bytes
+    """
+    rows = [dict((p, record.data.get(p)) for p in params) if params is not None else dict(record.data)
+            for record in records]
+    return json.dumps({'count': len(rows), 'records': rows}).encode('utf-8')
+
+
+def to_arrow(records, params):
+    """
+    :return: The records as an Arrow IPC stream (needs pyarrow)
+    :rtype: bytes
+    """
+    import pyarrow
+    records = list(records)
+    if params is None:
+        params = []
+        for record in records:
+            for p in record.data:
+                if p not in params:
+                    params.append(p)
+    table = pyarrow.table(dict((p, [record.data.get(p) for record in records]) for p in params))
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    Answers requests for the FileSet of its server
+    """
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'local'
+
+    def _send(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message):
+        self._send(status, json.dumps({'error': message}).encode('utf-8'))
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        fields = dict(urllib.parse.parse_qsl(url.query))
+        if url.path == '/stats':
+            return self._send(200, json.dumps(self.server.fileset.cache.stats()).encode('utf-8'))
+        if url.path == '/files':
+            return self._send(200, json.dumps(self.server.fileset.describe()).encode('utf-8'))
+        if url.path != '/records':
+            return self._error(404, "Unknown path %s" % url.path)
+        try:
+            query = parse_query(fields)
+            params = fields['params'].split(',') if fields.get('params') else None
+            limit = int(fields['limit']) if fields.get('limit') else self.server.limit
+            format = fields.get('format', 'json')
+            if format not in ('json', 'arrow'):
+                raise ValueError("format must be json or arrow")
+        except ValueError as e:
+            return self._error(400, str(e))
+        records = self.server.fileset.query(query, limit)
+        try:
+            if format == 'arrow':
+                try:
+                    body = to_arrow(records, params)
+                except ImportError:
+                    return self._error(501, "Arrow output needs pyarrow")
+                return self._send(200, body, 'application/vnd.apache.arrow.stream')
+            body = to_json(records, params)
+        except Exception as e:  # e.g. a file that can't be read
+            return self._error(500, str(e))
+        self._send(200, body)
+
+
+class _PoolMixIn(object):
+    # Handle each request in a fixed pool of threads (rather than a new thread each)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super(_PoolMixIn, self).server_close()
+        self.pool.shutdown()
+
+
+class QueryServer(_PoolMixIn, HTTPServer):
+    """
+    HTTP server for a FileSet, on a TCP port
+    """
+
+    def __init__(self, fileset, address=('127.0.0.1', 0), workers=4, limit=None, quiet=True):
+        """
+        :param fileset: The files to serve
+        :type fileset: FileSet
+        :param address: (host, port) - port 0 picks a free port (see server_address)
+        :type address: tuple
+        :param workers: Threads answering requests
+        :type workers: int
+        :param limit: Most records returned by a query that doesn't give a limit
+        :type limit: int
+        :param quiet: Don't log each request
+        :type quiet: bool
+        """
+        self.fileset = fileset
+        self.limit = limit
+        self.quiet = quiet
+        self.pool = concurrent.futures.ThreadPoolExecutor(workers)
+        HTTPServer.__init__(self, address, QueryHandler)
+
+
+class UnixQueryServer(_PoolMixIn, socketserver.UnixStreamServer):
+    """
+    HTTP server for a FileSet, on a Unix socket
+    """
+
+    def __init__(self, fileset, path, workers=4, limit=None, quiet=True):
+        """
+        :param path: The socket file (removed first if it exists)
+        :type path: str
+
+        Other parameters as for QueryServer.
+        """
+        self.fileset = fileset
+        self.limit = limit
+        self.quiet = quiet
+        self.pool = concurrent.futures.ThreadPoolExecutor(workers)
+        if os.path.exists(path):
+            os.remove(path)
+        socketserver.UnixStreamServer.__init__(self, path, QueryHandler)
+
+    def server_close(self):
+        super(UnixQueryServer, self).server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def serve(files, address=('127.0.0.1', 8036), socket=None, block_size=BLOCK_SIZE,
+          cache_records=1000000, workers=4, limit=None, quiet=True, directory=None):
+    """
+    Serve queries on a set of files until interrupted
+
+    :param files: The IMMA files
+    :type files: sequence of str
+    :param address: (host, port) to listen on
+    :type address: tuple
+    :param socket: Listen on this Unix socket instead
+    :type socket: str
+    :param block_size: Records in each block
+    :type block_size: int
+    :param cache_records: Most decoded records to keep in the cache
+    :type cache_records: int
+    :param workers: Threads answering requests
+    :type workers: int
+    :param limit: Most records returned by a query that doesn't give a limit
+    :type limit: int
+    :param directory: Directory for the index and summary files (see FileSet)
+    :type directory: str
+    """
+    fileset = FileSet(files, block_size, BlockCache(cache_records), directory)
+    if socket is not None:
+        server = UnixQueryServer(fileset, socket, workers, limit, quiet)
+    else:
+        server = QueryServer(fileset, address, workers, limit, quiet)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
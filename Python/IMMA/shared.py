@@ -0,0 +1,260 @@
+# Hand decoded columns between processes through shared memory
+#  A worker decodes records into fixed-type columnar blocks in a
+#  multiprocessing.shared_memory segment and sends back only a small
+#  descriptor; the consumer maps the segment and reads the columns in
+#  place, so the transfer cost doesn't depend on the number of records.
+
+import array
+import math
+import multiprocessing
+import os
+import secrets
+from multiprocessing import resource_tracker, shared_memory
+
+from . import columns, definitions, open_file
+
+# Stored for missing values in integer columns (float columns use NaN,
+#  character columns use blanks)
+MISSING_INT = -2 ** 31
+
+
+def column_type(p):
+    """
+    How a parameter is stored in a shared block
+
+    :param p: The parameter
+    :type p: str
+
+    :return: (type, width) - type is 'd' (float64) for scaled parameters,
+        'i' (int32) for integers and base36, 's' for characters (width bytes each)
+    :rtype: tuple
+    """
+    for attachment in sorted(definitions):
+        if p in definitions[attachment]:
+            length, scale, encoding = (definitions[attachment][p][0],
+                                       definitions[attachment][p][5],
+                                       definitions[attachment][p][6])
+            if encoding == 3:
+                if length is None:
+                    raise Exception("Parameter %s has no fixed length - can't share it" % p)
+                return ('s', length)
+            if scale is not None and scale != 1.0:
+                return ('d', 8)
+            return ('i', 4)
+    raise Exception("Unknown parameter %s" % p)
+
+
+def _encode(values, kind, width):
+    # Pack a list of values into bytes of the column type
+    if kind == 'd':
+        return array.array('d', [math.nan if v is None else v for v in values]).tobytes()
+    if kind == 'i':
+        return array.array('i', [MISSING_INT if v is None else v for v in values]).tobytes()
+    return b''.join((v or '').encode('latin-1')[:width].ljust(width) for v in values)
+
+
+def segment_name():
+    """
+    :return: A new, unique name for a shared memory segment
+    :rtype: str
+    """
+    return 'imma_%d_%s' % (os.getpid(), secrets.token_hex(6))
+
+
+def share_columns(values, params, name=None):
+    """
+    Copy columns into a new shared memory segment
+
+    The segment belongs to whoever opens the returned descriptor with
+    SharedColumns, who must unlink it when finished.
+
+    :param values: Parameter name -> list of values (as from IMMA.columns)
+    :type values: dict
+    :param params: The parameters to share
+    :type params: sequence of str
+    :param name: Name for the segment (default is one chosen by the system) -
+        so a parent process can free it without waiting for the descriptor
+    :type name: str
+
+    :return: Descriptor of the segment - small and picklable
+    :rtype: dict
+    """
+    n = len(values[params[0]]) if len(params) > 0 else 0
+    layout = []
+    blocks = []
+    offset = 0
+    for p in params:
+        kind, width = column_type(p)
+        block = _encode(values[p], kind, width)
+        layout.append((p, kind, width, offset, len(block)))
+        blocks.append(block)
+        offset += len(block)
+        offset += -offset % 8  # Keep each block aligned
+    segment = shared_memory.SharedMemory(name=name, create=True, size=max(offset, 1))
+    for (p, kind, width, start, size), block in zip(layout, blocks):
+        segment.buf[start:start + size] = block
+    # Hand ownership to the consumer - otherwise this process's resource
+    #  tracker may remove the segment when the process ends
+    resource_tracker.unregister(segment._name, 'shared_memory')
+    descriptor = {'name': segment.name, 'records': n, 'layout': layout}
+    segment.close()
+    return descriptor
+
+
+def decode_to_shared(filename, params, where=None, name=None):
+    """
+    Decode a file into a shared memory segment (for use in a worker process)
+
+    :param filename: The IMMA file
+    :type filename: str
+    :param params: Parameters to decode
+    :type params: sequence of str
+    :param where: Only use records for which where(record) is true
+    :type where: callable
+    :param name: Name for the segment (see share_columns)
+    :type name: str
+
+    :return: Descriptor, to be opened with SharedColumns
+    :rtype: dict
+    """
+    with open_file(filename) as fh:
+        return share_columns(columns(fh, params, where), params, name)
+
+
+def _decode_to_shared(args):
+    return decode_to_shared(*args)
+
+
+class SharedColumns(object):
+    """
+    Columns in a shared memory segment, read in place
+    """
+
+    def __init__(self, descriptor):
+        """
+        :param descriptor: From share_columns or decode_to_shared
+        :type descriptor: dict
+        """
+        self.descriptor = descriptor
+        self.records = descriptor['records']
+        self.segment = shared_memory.SharedMemory(name=descriptor['name'])
+        # Parameter name -> memoryview of the column ('d', 'i', or bytes for characters)
+        self.columns = {}
+        for p, kind, width, offset, size in descriptor['layout']:
+            view = self.segment.buf[offset:offset + size]
+            self.columns[p] = view.cast(kind) if kind != 's' else view
+
+    def __len__(self):
+        return self.records
+
+    def __getitem__(self, p):
+        return self.columns[p]
+
+    def values(self, p):
+        """
+        A column as a list of Python values (None for missing), like IMMA.columns gives
+
+        :param p: The parameter
+        :type p: str
+        :rtype: list
+        """
+        column = self.columns[p]
+        for name, kind, width, offset, size in self.descriptor['layout']:
+            if name == p:
+                break
+        if kind == 'd':
+            return [None if math.isnan(v) else v for v in column]
+        if kind == 'i':
+            return [None if v == MISSING_INT else v for v in column]
+        result = []
+        for i in range(self.records):
+            v = bytes(column[i * width:(i + 1) * width]).decode('latin-1')
+            result.append(v if v.strip() != '' else None)
+        return result
+
+    def as_numpy(self):
+        """
+        The columns as numpy arrays sharing the segment's memory (needs numpy)
+
+        :return: Parameter name -> numpy array (float64, int32 or S<width>)
+        :rtype: dict
+        """
+        import numpy
+        result = {}
+        for p, kind, width, offset, size in self.descriptor['layout']:
+            dtype = {'d': numpy.float64, 'i': numpy.int32}.get(kind, 'S%d' % width)
+            result[p] = numpy.frombuffer(self.segment.buf, dtype=dtype,
+                                         count=self.records, offset=offset)
+        return result
+
+    def close(self):
+        """
+        Stop using the segment (release any numpy arrays from as_numpy first)
+        """
+        for view in self.columns.values():
+            view.release()
+        self.columns = {}
+        self.segment.close()
+
+    def unlink(self):
+        """
+        Free the segment
+        """
+        self.segment.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        # Free the segment even if close fails (numpy arrays still in use)
+        try:
+            self.close()
+        finally:
+            self.unlink()
+
+
+def parallel_columns(filenames, params, where=None, processes=None):
+    """
+    Decode files in parallel, getting the columns back through shared memory
+
+    Each SharedColumns is unlinked when the loop moves on to the next one,
+    so copy out anything needed beyond that. If the loop ends early (break
+    or an exception) the workers are stopped, and any segments they made
+    for the files not reached are unlinked too.
+
+    :param filenames: The IMMA files
+    :type filenames: sequence of str
+    :param params: Parameters to decode
+    :type params: sequence of str
+    :param where: Only use records for which where(record) is true (must be picklable)
+    :type where: callable
+    :param processes: Number of worker processes (default is one per CPU)
+    :type processes: int
+
+    :return: generator of (filename, SharedColumns), in the order of filenames
+    """
+    # The segment names are chosen here, so those of files not reached can
+    #  be freed without waiting for the workers to finish them
+    names = [segment_name() for filename in filenames]
+    pool = multiprocessing.Pool(processes)
+    done = 0
+    try:
+        tasks = [(filename, params, where, name) for filename, name in zip(filenames, names)]
+        for filename, descriptor in zip(filenames, pool.imap(_decode_to_shared, tasks)):
+            with SharedColumns(descriptor) as shared:
+                done += 1  # Unlinked by SharedColumns from here on
+                yield filename, shared
+    finally:
+        pool.terminate()  # Waits for the workers to stop
+        for name in names[done:]:
+            _unlink(name)
+
+
+def _unlink(name):
+    # Free a segment, if it was made
+    try:
+        segment = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    segment.close()
+    segment.unlink()
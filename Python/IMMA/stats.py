@@ -0,0 +1,291 @@
+# Single-pass summary statistics for IMMA parameters
+#  Counts, missing fraction, min/max, mean/variance, approximate quantiles
+#  and histograms of coded values, collected as the records are read.
+#  Collectors from separate workers can be merged.
+
+import random
+
+from . import definitions, parameters
+
+
+def _is_code(p):
+    # Integer-coded parameters (unscaled integers and base36), and short
+    #  character codes, get a histogram of their values
+    for attachment in definitions:
+        if p in definitions[attachment]:
+            length, scale, encoding = (definitions[attachment][p][0],
+                                       definitions[attachment][p][5],
+                                       definitions[attachment][p][6])
+            if encoding == 2:
+                return True
+            if encoding == 1:
+                return scale is None or scale == 1.0
+            return length is not None and length <= 2
+    return False
+
+
+class QuantileSketch(object):
+    """
+    Approximate quantiles in bounded memory (a simplified KLL sketch)
+
+    Values are kept in a stack of buffers; buffer i holds values of weight 2**i.
+    When a buffer fills it is sorted and every other value (from a random
+    start) is moved up to the next buffer.
+    """
+
+    def __init__(self, k=200, seed=None):
+        """
+        :param k: Capacity of each buffer - larger is more accurate
+        :type k: int
+        """
+        self.k = k
+        self.levels = [[]]
+        self.rng = random.Random(seed)
+
+    def add(self, value):
+        self.levels[0].append(value)
+        if len(self.levels[0]) >= self.k:
+            self._compress()
+
+    def _compress(self):
+        for i in range(len(self.levels)):
+            if len(self.levels[i]) < self.k:
+                continue
+            if i + 1 == len(self.levels):
+                self.levels.append([])
+            level = sorted(self.levels[i])
+            keep = []
+            if len(level) % 2 == 1:  # Odd one out stays at this level
+                keep.append(level.pop())
+            self.levels[i + 1].extend(level[self.rng.randint(0, 1)::2])
+            self.levels[i] = keep
+
+    def merge(self, other):
+        """
+        Add the values seen by another sketch to this one
+        """
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for i, level in enumerate(other.levels):
+            self.levels[i].extend(level)
+        self._compress()
+
+    def count(self):
+        return sum(len(level) << i for i, level in enumerate(self.levels))
+
+    def quantiles(self, probabilities):
+        """
+        :param probabilities: Probabilities (0-1) of the quantiles wanted
+        :type probabilities: sequence of float
+
+        :return: Approximate quantiles (None if no values have been added)
+        :rtype: list
+        """
+        weighted = sorted((value, 1 << i) for i, level in enumerate(self.levels) for value in level)
+        total = sum(weight for value, weight in weighted)
+        result = []
+        for probability in probabilities:
+            if total == 0:
+                result.append(None)
+                continue
+            target = probability * total
+            cumulative = 0
+            for value, weight in weighted:
+                cumulative += weight
+                if cumulative >= target:
+                    break
+            result.append(value)
+        return result
+
+
+class ParameterStats(object):
+    """
+    Summary statistics for one parameter
+    """
+
+    def __init__(self, name, histogram=None, k=200):
+        """
+        :param name: The parameter
+        :type name: str
+        :param histogram: Keep a histogram of values (default is to do so for coded parameters)
+        :type histogram: bool
+        :param k: Buffer size for the quantile sketch
+        :type k: int
+        """
+        self.name = name
+        self.count = 0  # Non-missing values
+        self.missing = 0
+        self.min = None
+        self.max = None
+        self.numeric = 0  # Numeric values (others are strings)
+        self.mean = 0.0
+        self.m2 = 0.0  # Sum of squared differences from the mean
+        self.sketch = QuantileSketch(k)
+        self.histogram = {} if (histogram if histogram is not None else _is_code(name)) else None
+
+    def add(self, value):
+        if value is None:
+            self.missing += 1
+            return
+        self.count += 1
+        if self.histogram is not None:
+            self.histogram[value] = self.histogram.get(value, 0) + 1
+        if isinstance(value, str):
+            return
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        # Welford's algorithm
+        self.numeric += 1
+        delta = value - self.mean
+        self.mean += delta / self.numeric
+        self.m2 += delta * (value - self.mean)
+        self.sketch.add(value)
+
+    def merge(self, other):
+        """
+        Combine the statistics of another collector for the same parameter into this one
+        """
+        self.count += other.count
+        self.missing += other.missing
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        n = self.numeric + other.numeric
+        if n > 0:
+            delta = other.mean - self.mean
+            self.m2 += other.m2 + delta * delta * self.numeric * other.numeric / n
+            self.mean += delta * other.numeric / n
+        self.numeric = n
+        self.sketch.merge(other.sketch)
+        if self.histogram is not None and other.histogram is not None:
+            for value, count in other.histogram.items():
+                self.histogram[value] = self.histogram.get(value, 0) + count
+
+    def result(self, probabilities=(0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)):
+        """
+        :param probabilities: Probabilities of the quantiles to report
+        :type probabilities: sequence of float
+
+        :return: The statistics
+        :rtype: dict
+        """
+        total = self.count + self.missing
+        result = {'count': self.count,
+                  'missing': self.missing,
+                  'missing_fraction': self.missing / total if total > 0 else None,
+                  'min': self.min,
+                  'max': self.max,
+                  'mean': self.mean if self.numeric > 0 else None,
+                  'variance': self.m2 / (self.numeric - 1) if self.numeric > 1 else None,
+                  'quantiles': dict(zip(probabilities, self.sketch.quantiles(probabilities)))}
+        if self.histogram is not None:
+            result['histogram'] = dict(self.histogram)
+        return result
+
+
+class StatsCollector(object):
+    """
+    Summary statistics for a set of parameters, collected one record at a time
+
+    Usage::
+
+        stats = StatsCollector(['SST', 'AT', 'WW'])
+        for record in stats.observe(IMMA.records(fh)):
+            ...  # any other processing
+        print(stats.result())
+    """
+
+    def __init__(self, params=None, k=200):
+        """
+        :param params: Parameters to summarise (default is all of those in the records seen)
+        :type params: sequence of str
+        :param k: Buffer size for the quantile sketches
+        :type k: int
+        """
+        self.params = list(params) if params is not None else None
+        self.k = k
+        self.records = 0
+        self.stats = {}  # Parameter -> ParameterStats
+        for p in self.params or []:
+            self.stats[p] = ParameterStats(p, k=k)
+
+    def _get(self, p):
+        if p not in self.stats:
+            self.stats[p] = ParameterStats(p, k=self.k)
+            # Records seen before this parameter appeared didn't have it
+            self.stats[p].missing = self.records
+        return self.stats[p]
+
+    def add(self, record):
+        """
+        Add the values from one IMMA record
+        """
+        if self.params is None:
+            for attachment in record.attachments:
+                for p in parameters['%02d' % attachment]:
+                    self._get(p)
+            for p in self.stats:
+                self.stats[p].add(record.data.get(p))
+        else:
+            for p in self.params:
+                self.stats[p].add(record.data.get(p))
+        self.records += 1
+
+    def add_columns(self, columns):
+        """
+        Add the values from a set of columns (as from IMMA.columns)
+
+        :param columns: Parameter name -> list of values
+        :type columns: dict
+        """
+        lengths = set(len(values) for values in columns.values())
+        if len(lengths) > 1:
+            raise Exception("Columns have different lengths: %s" % sorted(lengths))
+        n = lengths.pop() if len(lengths) > 0 else 0
+        for p, values in columns.items():
+            if self.params is not None and p not in self.stats:
+                continue
+            stats = self._get(p)
+            for value in values:
+                stats.add(value)
+        # Parameters not in the columns are missing from every record
+        for p, stats in self.stats.items():
+            if p not in columns:
+                stats.missing += n
+        self.records += n
+
+    def observe(self, records):
+        """
+        Pass records through, collecting statistics on the way
+
+        :param records: Iterable of IMMA records
+        :return: generator of the same records
+        """
+        for record in records:
+            self.add(record)
+            yield record
+
+    def merge(self, other):
+        """
+        Combine the statistics from another collector (e.g. from a worker process) into this one
+        """
+        for p, stats in other.stats.items():
+            if p in self.stats:
+                self.stats[p].merge(stats)
+            elif self.params is None:
+                self._get(p).merge(stats)
+        for p in self.stats:
+            if p not in other.stats:
+                self.stats[p].missing += other.records
+        self.records += other.records
+        return self
+
+    def result(self, probabilities=(0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)):
+        """
+        :return: Parameter name -> statistics (see ParameterStats.result)
+        :rtype: dict
+        """
+        return dict((p, stats.result(probabilities)) for p, stats in self.stats.items())
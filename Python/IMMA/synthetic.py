@@ -0,0 +1,139 @@
+# Synthetic IMMA records, for testing and benchmarking
+#  Values are drawn at random from the ranges given in the parameter
+#  definitions, so the records are valid (and survive a write/read round-trip).
+
+import io
+import math
+import random
+
+from . import IMMA, get_definitions, get_parameters
+
+BASE36 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def random_value(definition, rng, supd_length=60):
+    """
+    Make a random valid value for a parameter
+
+    :param definition: The parameter definition (from IMMA.definitions)
+    :type definition: tuple
+    :param rng: Random number generator
+    :type rng: random.Random
+    :param supd_length: Maximum length of undefined-length (supplemental) strings
+    :type supd_length: int
+
+    :return: int, float or str - as IMMA.read would decode it
+    """
+    length, minimum, maximum, alt_minimum, alt_maximum, scale, encoding = definition
+
+    if encoding == 3:  # Characters - min and max are character codes
+        ranges = [(int(minimum) if minimum is not None else 33,
+                   int(maximum) if maximum is not None else 126)]
+        if alt_minimum is not None:
+            ranges.append((int(alt_minimum), int(alt_maximum)))
+        if length is None:
+            length = rng.randint(1, supd_length)
+        # No blanks, so the value decodes back to exactly the same string
+        return ''.join(chr(rng.randint(max(low, 33), high))
+                       for low, high in [rng.choice(ranges) for i in range(length)])
+
+    if encoding == 2:  # Base36 - a single digit
+        low = int(minimum) if minimum is not None else 0
+        high = int(maximum) if maximum is not None else len(BASE36) - 1
+        return rng.randint(low, min(high, len(BASE36) - 1))
+
+    # Integer, possibly scaled
+    if scale is None:
+        scale = 1.
+    low = 0
+    high = 10 ** length - 1
+    if minimum is not None:
+        low = max(-(10 ** (length - 1) - 1), int(math.ceil(minimum / scale - 1e-6)))
+    if maximum is not None:
+        high = min(high, int(math.floor(maximum / scale + 1e-6)))
+    value = rng.randint(low, high)
+    if scale != 1.0:
+        return value * scale
+    return value
+
+
+def random_record(attachments=(0, 1, 99), rng=None, missing=0.1):
+    """
+    Make a random IMMA record
+
+    :param attachments: The attachments the record should have
+        (the core, 0, is always included)
+    :type attachments: sequence of int
+    :param rng: Random number generator
+    :type rng: random.Random
+    :param missing: Probability that each parameter is missing (None)
+    :type missing: float
+
+    :return: IMMA
+    """
+    if rng is None:
+        rng = random
+    if 0 not in attachments:
+        attachments = (0,) + tuple(attachments)
+    record = IMMA()
+    for attachment in attachments:
+        if get_parameters(attachment) is None:
+            raise Exception("Bad attachment - Unsupported attachment ID %d" % attachment)
+        definitions = get_definitions(attachment)
+        for p in get_parameters(attachment):
+            # Supplemental data are always present - a record can't end in
+            #  an empty attachment and still be read back
+            if definitions[p][0] is not None and rng.random() < missing:
+                record[p] = None
+            else:
+                record[p] = random_value(definitions[p], rng)
+        record.attachments.append(attachment)
+    record['ATTC'] = len(record.attachments) - 1
+    return record
+
+
+def generate(fh, n, attachments=(0, 1, 99), seed=None, missing=0.1, distinct=None):
+    """
+    Write random IMMA records to a file
+
+    :param fh: The filehandle to write to
+    :type fh: file handle
+    :param n: Number of records to write
+    :type n: int
+    :param attachments: The attachments each record should have - or a list
+        of such sequences, in which case each record gets one of them at random
+    :type attachments: sequence of int, or list of sequences
+    :param seed: Seed for the random number generator
+    :type seed: int
+    :param missing: Probability that each parameter is missing (None)
+    :type missing: float
+    :param distinct: Only make this many different records, and repeat them
+        (much faster for very large files)
+    :type distinct: int
+
+    :return: Number of records written
+    :rtype: int
+    """
+    rng = random.Random(seed)
+    if len(attachments) > 0 and isinstance(attachments[0], int):
+        mix = [attachments]
+    else:
+        mix = list(attachments)
+
+    if distinct is None or distinct >= n:
+        for i in range(n):
+            random_record(rng.choice(mix), rng, missing).write(fh)
+        return n
+
+    pool = []
+    for i in range(distinct):
+        pool.append(random_record(rng.choice(mix), rng, missing))
+    lines = []
+    for record in pool:
+        line = io.StringIO()
+        record.write(line)
+        lines.append(line.getvalue())
+    for i in range(n):
+        fh.write(lines[i % distinct])
+    return n
+
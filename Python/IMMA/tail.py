@@ -0,0 +1,212 @@
+# Incremental reading of IMMA files that are still being written
+#  Remember how far each file has been read (in a checkpoint file), and on
+#  each poll decode only the records completed since then.
+
+import fnmatch
+import hashlib
+import json
+import os
+
+from . import IMMA
+
+# Bytes before the read position whose hash is kept, to tell if a file
+#  has been rewritten since it was read
+FINGERPRINT = 256
+
+
+def _fingerprint(fh, offset):
+    # Hash of the FINGERPRINT bytes before offset in an open file
+    start = max(0, offset - FINGERPRINT)
+    fh.seek(start)
+    return hashlib.sha1(fh.read(offset - start)).hexdigest()
+
+
+class TailReader(object):
+    """
+    Read the new records appended to a set of growing IMMA files
+    """
+
+    def __init__(self, paths, checkpoint=None, pattern='*', on_error=None):
+        """
+        :param paths: Files, and directories whose files are all read
+        :type paths: list of str
+
+        :param checkpoint: File in which to keep the read positions between runs
+        :type checkpoint: str
+
+        :param pattern: Only read files in the directories whose names match this glob pattern
+        :type pattern: str
+
+        :param on_error: Called as on_error(filename, line, exception) for each
+            line that can't be decoded (the line is skipped either way, and
+            counted in errors)
+        :type on_error: callable
+        """
+        if isinstance(paths, str):
+            paths = [paths]
+        self.paths = list(paths)
+        self.checkpoint = checkpoint
+        self.pattern = pattern
+        self.on_error = on_error
+        self.errors = 0  # Lines skipped because they couldn't be decoded
+        # filename -> {'inode': ..., 'offset': bytes read, 'partial': incomplete last line,
+        #              'fingerprint': hash of the bytes before offset}
+        self.state = {}
+        if checkpoint is not None and os.path.exists(checkpoint):
+            with open(checkpoint) as fh:
+                self.state = json.load(fh)
+
+    def files(self):
+        """
+        :return: The files currently being followed
+        :rtype: list
+        """
+        result = []
+        for path in self.paths:
+            if os.path.isdir(path):
+                for name in sorted(os.listdir(path)):
+                    filename = os.path.join(path, name)
+                    if fnmatch.fnmatch(name, self.pattern) and os.path.isfile(filename):
+                        result.append(filename)
+            elif os.path.isfile(path):
+                result.append(path)
+        return result
+
+    def _inodes(self):
+        # inode -> file name, for every file in the followed directories, and
+        #  in the directories of the followed files, whatever its name
+        directories = []
+        for path in self.paths:
+            directory = path if os.path.isdir(path) else os.path.dirname(path) or '.'
+            if directory not in directories:
+                directories.append(directory)
+        result = {}
+        for directory in directories:
+            try:
+                names = sorted(os.listdir(directory))
+            except OSError:
+                continue
+            for name in names:
+                filename = os.path.join(directory, name)
+                try:
+                    stat = os.stat(filename)
+                except OSError:
+                    continue
+                if os.path.isfile(filename):
+                    result.setdefault(stat.st_ino, filename)
+        return result
+
+    def _followed(self):
+        # The files to read: those matching paths and pattern, and any file
+        #  read before that has been renamed (rotated) to a name that doesn't
+        #  match, so the rest of it isn't lost
+        result = self.files()
+        claimed = set()
+        for filename in result:
+            try:
+                claimed.add(os.stat(filename).st_ino)
+            except OSError:
+                pass
+        inodes = None
+        for filename, state in sorted(self.state.items()):
+            if state['inode'] in claimed:
+                continue
+            if inodes is None:
+                inodes = self._inodes()
+            renamed = inodes.get(state['inode'])
+            if renamed is not None and renamed not in result:
+                result.append(renamed)
+                claimed.add(state['inode'])
+        return result
+
+    def save(self):
+        """
+        Write the read positions to the checkpoint file
+        """
+        if self.checkpoint is None:
+            return
+        tmp = '%s.tmp' % self.checkpoint
+        with open(tmp, 'w') as fh:
+            json.dump(self.state, fh)
+        os.replace(tmp, self.checkpoint)
+
+    def _start(self, filename, fh):
+        # Where to start reading a file: carry on from the checkpoint if it is the same
+        #  file, and follow a file that has been renamed (rotated) to a new name.
+        stat = os.fstat(fh.fileno())
+        state = self.state.get(filename)
+        if state is None or state['inode'] != stat.st_ino:
+            state = None
+            for other, other_state in self.state.items():
+                if other != filename and other_state['inode'] == stat.st_ino:
+                    state = other_state
+                    break
+        if state is None or stat.st_size < state['offset']:  # New or truncated
+            return {'inode': stat.st_ino, 'offset': 0, 'partial': ''}
+        if 'fingerprint' in state and _fingerprint(fh, state['offset']) != state['fingerprint']:
+            # Truncated and written again, to at least the old size
+            return {'inode': stat.st_ino, 'offset': 0, 'partial': ''}
+        return dict(state)
+
+    def poll(self, save=False):
+        """
+        Read the records completed since the last poll
+
+        An incomplete last line is remembered, and completed by the next poll.
+        A file that has shrunk since the last poll, or whose bytes before the
+        position reached have changed, is taken to have been truncated (and
+        perhaps written again), and is read again from the start. A file that
+        has been renamed within the directories followed (e.g. a.imma to
+        a.imma.1) is read to its end under its new name, even if that doesn't
+        match the pattern, and is then forgotten - its last line is taken to
+        be complete.
+
+        The positions reached are only written to the checkpoint file by
+        save(): call it once the records have been dealt with, so a crash
+        in between means they are read again rather than lost. (With
+        save=True the checkpoint is written before poll returns, so
+        records not yet dealt with at a crash are lost.)
+
+        :param save: Update the checkpoint file before returning
+        :type save: bool
+
+        :return: (filename, IMMA record) for each new record
+        :rtype: list
+        """
+        result = []
+        state = {}
+        matching = set(self.files())
+        for filename in self._followed():
+            try:
+                fh = open(filename, 'rb')
+            except OSError:  # Removed since it was listed
+                continue
+            with fh:
+                current = self._start(filename, fh)
+                fh.seek(current['offset'])
+                data = fh.read()
+                current['offset'] += len(data)
+                current['fingerprint'] = _fingerprint(fh, current['offset'])
+            lines = (current['partial'] + data.decode('latin-1')).split('\n')
+            current['partial'] = lines.pop()
+            rotated = filename not in matching
+            if rotated:  # Finished with - nothing more will be written to it
+                lines.append(current['partial'])
+            for line in lines:
+                if len(line.strip()) == 0:
+                    continue
+                record = IMMA()
+                try:
+                    record.read(line)
+                except Exception as e:
+                    self.errors += 1
+                    if self.on_error is not None:
+                        self.on_error(filename, line, e)
+                    continue
+                result.append((filename, record))
+            if not rotated:
+                state[filename] = current
+        self.state = state
+        if save:
+            self.save()
+        return result
@@ -0,0 +1,430 @@
+# Ship-track index and trajectory checks for IMMA records
+#  Index the reports of each ship (ID, C1, DCK) across a set of files,
+#  so a ship's track can be pulled out without rescanning everything.
+
+import array
+import datetime
+import json
+import math
+import os
+
+try:
+    import numpy
+except ImportError:  # The track checks fall back to pure Python
+    numpy = None
+
+from . import IMMA, peek
+
+# Parameters needed to index a report, and to put it on a track
+KEY_PARAMS = ('ID', 'C1', 'DCK')
+TRACK_PARAMS = ('YR', 'MO', 'DY', 'HR', 'LAT', 'LON')
+
+# Mean radius of the Earth in nautical miles (so speeds come out in knots)
+EARTH_RADIUS = 3440.065
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def record_time(record, exact=False):
+    """
+    Time of a record as hours since 1970-01-01
+
+    Many historical records have no hour: they are taken to be at the start
+    of their day (see has_hour), unless exact is set.
+
+    :param record: A decoded IMMA record (or dict of values)
+    :type record: IMMA
+    :param exact: Return None if the hour is missing
+    :type exact: bool
+
+    :return: float, or None if the date (or, if exact, the hour) is missing or invalid
+    """
+    try:
+        date = datetime.datetime(record['YR'], record['MO'], record['DY'])
+        hours = record['HR']
+    except (KeyError, TypeError, ValueError):
+        return None
+    if hours is None:
+        if exact:
+            return None
+        hours = 0
+    return (date - EPOCH).total_seconds() / 3600.0 + hours
+
+
+def has_hour(record):
+    """
+    :return: Whether the record's time (from record_time) is to the hour, rather than the day
+    :rtype: bool
+    """
+    return record_time(record, exact=True) is not None
+
+
+def track_key(record):
+    """
+    The key identifying the ship that made a report
+
+    :param record: A decoded IMMA record (or dict of values, as from peek)
+    :type record: IMMA
+
+    :return: (ID, C1, DCK) tuple, or None if the record has no ID
+    """
+    values = record.data if isinstance(record, IMMA) else record
+    ship = values.get('ID')
+    if ship is None or ship.strip() == '':
+        return None
+    return (ship.strip(), values.get('C1'), values.get('DCK'))
+
+
+def _to_array(values):
+    # numpy float array -> array.array('d') without a Python-level loop
+    result = array.array('d')
+    result.frombytes(numpy.ascontiguousarray(values, dtype=numpy.float64).tobytes())
+    return result
+
+
+def great_circle(lat1, lon1, lat2, lon2):
+    """
+    Distances and initial headings between two sets of positions
+
+    Done with numpy if it is installed, in pure Python otherwise.
+
+    :param lat1: Latitudes of the start points (degrees)
+    :type lat1: sequence of float
+    :param lon1: Longitudes of the start points (degrees)
+    :type lon1: sequence of float
+    :param lat2: Latitudes of the end points (degrees)
+    :type lat2: sequence of float
+    :param lon2: Longitudes of the end points (degrees)
+    :type lon2: sequence of float
+
+    :return: (distances in nautical miles, headings in degrees from north)
+    :rtype: tuple of array.array
+    """
+    if numpy is not None:
+        la1 = numpy.radians(numpy.asarray(lat1, dtype=numpy.float64))
+        la2 = numpy.radians(numpy.asarray(lat2, dtype=numpy.float64))
+        dlon = numpy.radians(numpy.asarray(lon2, dtype=numpy.float64) -
+                             numpy.asarray(lon1, dtype=numpy.float64))
+        h = (numpy.sin((la2 - la1) / 2) ** 2 +
+             numpy.cos(la1) * numpy.cos(la2) * numpy.sin(dlon / 2) ** 2)
+        distances = 2 * EARTH_RADIUS * numpy.arcsin(numpy.minimum(1.0, numpy.sqrt(h)))
+        headings = numpy.degrees(numpy.arctan2(numpy.sin(dlon) * numpy.cos(la2),
+                                               numpy.cos(la1) * numpy.sin(la2) -
+                                               numpy.sin(la1) * numpy.cos(la2) * numpy.cos(dlon)))
+        return _to_array(distances), _to_array(headings % 360.0)
+    distances = array.array('d')
+    headings = array.array('d')
+    radians = math.radians
+    sin = math.sin
+    cos = math.cos
+    for la1, lo1, la2, lo2 in zip(lat1, lon1, lat2, lon2):
+        la1 = radians(la1)
+        la2 = radians(la2)
+        dlon = radians(lo2 - lo1)
+        h = (sin((la2 - la1) / 2) ** 2 +
+             cos(la1) * cos(la2) * sin(dlon / 2) ** 2)
+        distances.append(2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(h))))
+        heading = math.degrees(math.atan2(sin(dlon) * cos(la2),
+                                          cos(la1) * sin(la2) -
+                                          sin(la1) * cos(la2) * cos(dlon)))
+        headings.append(heading % 360.0)
+    return distances, headings
+
+
+class Track(object):
+    """
+    The time-sorted reports of one ship
+    """
+
+    def __init__(self, key, reports):
+        """
+        :param key: The (ID, C1, DCK) key of the ship
+        :type key: tuple
+
+        :param reports: (time, lat, lon, location[, has_hour]) for each report -
+            has_hour (default True) is False if the time is only to the day
+        :type reports: list
+        """
+        self.key = key
+        reports = sorted(reports, key=lambda report: report[0])
+        self.time = array.array('d', [report[0] for report in reports])
+        self.lat = array.array('d', [report[1] for report in reports])
+        self.lon = array.array('d', [report[2] for report in reports])
+        self.locations = [report[3] for report in reports]
+        # 1 if the report's time is to the hour, 0 if only to the day
+        self.hourly = array.array('b', [1 if len(report) < 5 or report[4] else 0
+                                        for report in reports])
+
+    def __len__(self):
+        return len(self.time)
+
+    def legs(self):
+        """
+        Distance, time, speed and heading for each leg of the track
+
+        Leg i runs from report i to report i+1.
+
+        :return: (distances (nm), durations (hours), speeds (knots), headings (degrees))
+        :rtype: tuple of array.array
+        """
+        distances, headings = great_circle(self.lat[:-1], self.lon[:-1],
+                                           self.lat[1:], self.lon[1:])
+        if numpy is not None:
+            time = numpy.frombuffer(self.time, dtype=numpy.float64)
+            durations = numpy.diff(time)
+            distance = numpy.frombuffer(distances, dtype=numpy.float64)
+            return distances, _to_array(durations), _to_array(self._speeds(distance, durations)), headings
+        durations = array.array('d', [t2 - t1 for t1, t2 in zip(self.time[:-1], self.time[1:])])
+        speeds = array.array('d')
+        for distance, duration in zip(distances, durations):
+            if duration > 0:
+                speeds.append(distance / duration)
+            elif distance > 0:
+                speeds.append(float('inf'))
+            else:
+                speeds.append(0.0)
+        return distances, durations, speeds, headings
+
+    @staticmethod
+    def _speeds(distances, durations):
+        # numpy version of the speed calculation in legs
+        speeds = numpy.where(distances > 0, numpy.inf, 0.0)
+        moving = durations > 0
+        speeds[moving] = distances[moving] / durations[moving]
+        return speeds
+
+    def speeds(self):
+        """
+        :return: Speed (knots) for each leg of the track
+        :rtype: array.array
+        """
+        return self.legs()[2]
+
+    def headings(self):
+        """
+        :return: Heading (degrees from north) for each leg of the track
+        :rtype: array.array
+        """
+        return self.legs()[3]
+
+    def check(self, max_speed=40.0, max_turn=None):
+        """
+        Flag implausible legs of the track
+
+        A leg is implausible if it needs a speed over max_speed or, if
+        max_turn is given, a change of heading from the previous leg
+        of more than max_turn degrees. For a leg with an end whose time
+        is only known to the day, the speed is worked out allowing up to
+        24 hours more than the recorded duration.
+
+        :param max_speed: Largest plausible speed (knots)
+        :type max_speed: float
+        :param max_turn: Largest plausible change of heading (degrees)
+        :type max_turn: float
+
+        :return: 1 for each implausible leg, 0 otherwise
+        :rtype: array.array
+        """
+        distances, durations, speeds, headings = self.legs()
+        if numpy is not None:
+            distance = numpy.frombuffer(distances, dtype=numpy.float64)
+            duration = numpy.frombuffer(durations, dtype=numpy.float64)
+            hourly = numpy.frombuffer(self.hourly, dtype=numpy.int8)
+            duration = duration + 24.0 * ((hourly[:-1] == 0) | (hourly[1:] == 0))
+            bad = self._speeds(distance, duration) > max_speed
+            if max_turn is not None and len(distance) > 1:
+                heading = numpy.frombuffer(headings, dtype=numpy.float64)
+                turn = numpy.abs(numpy.diff(heading)) % 360.0
+                turn = numpy.minimum(turn, 360.0 - turn)
+                moved = (distance[1:] != 0) & (distance[:-1] != 0)
+                bad[1:] |= moved & (turn > max_turn)
+            return array.array('b', bad.astype(numpy.int8).tobytes())
+        flags = array.array('b')
+        for i, (distance, duration, speed) in enumerate(zip(distances, durations, speeds)):
+            if not (self.hourly[i] and self.hourly[i + 1]):
+                duration += 24.0
+                speed = distance / duration if duration > 0 else (float('inf') if distance > 0 else 0.0)
+            flags.append(1 if speed > max_speed else 0)
+        if max_turn is not None:
+            for i in range(1, len(headings)):
+                if distances[i] == 0 or distances[i - 1] == 0:
+                    continue
+                turn = abs(headings[i] - headings[i - 1]) % 360.0
+                if min(turn, 360.0 - turn) > max_turn:
+                    flags[i] = 1
+        return flags
+
+
+class TrackIndex(object):
+    """
+    Index from ship (ID, C1, DCK) to the locations of its reports in a set of files
+    """
+
+    def __init__(self, files=None):
+        self.files = []  # [filename, size, mtime] for each indexed file
+        self.locations = {}  # (ID, C1, DCK) -> list of (file number, byte offset)
+        self.errors = {}  # Filename -> number of lines that couldn't be decoded (and aren't indexed)
+        if files is not None:
+            for filename in files:
+                self.add_file(filename)
+
+    def add_file(self, filename):
+        """
+        Add the records in a file to the index
+
+        :param filename: The IMMA file to index
+        :type filename: str
+
+        :return: Number of records indexed (lines that can't be decoded are
+            skipped, and counted in errors)
+        :rtype: int
+        """
+        stat = os.stat(filename)
+        number = len(self.files)
+        self.files.append([filename, stat.st_size, stat.st_mtime])
+        count = 0
+        offset = 0
+        with open(filename, 'rb') as fh:
+            for raw in fh:
+                try:
+                    values = peek(raw.decode('latin-1'), KEY_PARAMS)
+                except Exception:
+                    self.errors[filename] = self.errors.get(filename, 0) + 1
+                    offset += len(raw)
+                    continue
+                key = track_key(values)
+                if key is not None:
+                    self.locations.setdefault(key, []).append((number, offset))
+                    count += 1
+                offset += len(raw)
+        return count
+
+    def stale(self):
+        """
+        :return: Names of indexed files that have changed since they were indexed
+        :rtype: list
+        """
+        result = []
+        for filename, size, mtime in self.files:
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                result.append(filename)
+                continue
+            if stat.st_size != size or stat.st_mtime != mtime:
+                result.append(filename)
+        return result
+
+    def ids(self):
+        """
+        :return: The distinct ship IDs in the index
+        :rtype: list
+        """
+        return sorted(set(key[0] for key in self.locations))
+
+    def keys(self, id=None):
+        """
+        :param id: Only return keys for this ship ID
+        :type id: str
+
+        :return: The (ID, C1, DCK) keys in the index
+        :rtype: list
+        """
+        return [key for key in self.locations if id is None or key[0] == id]
+
+    def records(self, key):
+        """
+        Read the records for one ship from the indexed files
+
+        :param key: The (ID, C1, DCK) key of the ship
+        :type key: tuple
+
+        :return: generator of (location, IMMA record)
+        """
+        for location, line in self._lines(key):
+            record = IMMA()
+            record.read(line)
+            yield location, record
+
+    def _lines(self, key):
+        # (location, line) for each of the records of one ship
+        locations = sorted(self.locations.get(key, []))
+        fh = None
+        current = None
+        try:
+            for number, offset in locations:
+                if number != current:
+                    if fh is not None:
+                        fh.close()
+                    fh = open(self.files[number][0], 'rb')
+                    current = number
+                fh.seek(offset)
+                yield (number, offset), fh.readline().decode('latin-1')
+        finally:
+            if fh is not None:
+                fh.close()
+
+    def tracks(self, id, c1=None, dck=None):
+        """
+        Get the time-sorted tracks of a ship
+
+        A ship ID may be shared by several (C1, DCK) sources, each of
+        which gives a separate track. Reports without a valid date or
+        position are left out; those with no hour are put at the start of
+        their day, and marked as such in the Track's hourly array.
+
+        :param id: The ship ID
+        :type id: str
+        :param c1: Only use reports with this country code
+        :type c1: str
+        :param dck: Only use reports from this deck
+        :type dck: int
+
+        :return: One Track for each matching (ID, C1, DCK) key
+        :rtype: list
+        """
+        result = []
+        for key in sorted(self.keys(id), key=str):
+            if c1 is not None and key[1] != c1:
+                continue
+            if dck is not None and key[2] != dck:
+                continue
+            reports = []
+            for location, line in self._lines(key):
+                values = peek(line, TRACK_PARAMS)
+                time = record_time(values)
+                if time is None or values['LAT'] is None or values['LON'] is None:
+                    continue
+                reports.append((time, values['LAT'], values['LON'], location, has_hour(values)))
+            result.append(Track(key, reports))
+        return result
+
+    def save(self, filename):
+        """
+        Write the index to a file, so it can be re-used without rescanning
+
+        :param filename: File to write the index to
+        :type filename: str
+        """
+        with open(filename, 'w') as fh:
+            json.dump({'files': self.files,
+                       'locations': [[list(key), value] for key, value in self.locations.items()]},
+                      fh)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Read an index written by save
+
+        :param filename: File to read the index from
+        :type filename: str
+
+        :return: TrackIndex
+        """
+        with open(filename) as fh:
+            stored = json.load(fh)
+        index = cls()
+        index.files = stored['files']
+        for key, value in stored['locations']:
+            index.locations[tuple(key)] = [tuple(location) for location in value]
+        return index
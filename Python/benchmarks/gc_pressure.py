@@ -0,0 +1,86 @@
+# Compare decoding into a new record for each line with re-using one record
+#  (IMMA.read_into), counting garbage collections as well as time.
+#
+# Usage: python benchmarks/gc_pressure.py [--lines 1000000] [--keep]
+#  --keep holds on to one value from each record, as most analysis loops do,
+#  so the collector sees the heap grow.
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import IMMA
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', 'R', 'IMMA', 'inst', 'extdata', 'tests', 'basic.imma')
+
+
+def make_file(filename, n):
+    with open(SAMPLE) as fh:
+        lines = [line for line in fh if len(line.strip()) > 0]
+    with open(filename, 'w') as fh:
+        for i in range(n):
+            fh.write(lines[i % len(lines)])
+
+
+class Collections(object):
+    # Count the collections done by the garbage collector, by generation
+
+    def __init__(self):
+        self.counts = [0, 0, 0]
+
+    def __call__(self, phase, info):
+        if phase == 'start':
+            self.counts[info['generation']] += 1
+
+
+def run(filename, reuse, keep):
+    counter = Collections()
+    kept = []
+    gc.collect()
+    gc.callbacks.append(counter)
+    try:
+        start = time.perf_counter()
+        with open(filename) as fh:
+            if reuse:
+                record = IMMA.IMMA()
+                for line in fh:
+                    IMMA.read_into(record, line)
+                    if keep:
+                        kept.append(record['SLP'])
+            else:
+                for line in fh:
+                    record = IMMA.read(line)
+                    if keep:
+                        kept.append(record['SLP'])
+        elapsed = time.perf_counter() - start
+    finally:
+        gc.callbacks.remove(counter)
+    return elapsed, counter.counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare IMMA.read with IMMA.read_into')
+    parser.add_argument('--lines', type=int, default=1000000)
+    parser.add_argument('--keep', action='store_true')
+    args = parser.parse_args()
+
+    fd, filename = tempfile.mkstemp(suffix='.imma')
+    os.close(fd)
+    try:
+        make_file(filename, args.lines)
+        for name, reuse in (('new record per line', False), ('read_into', True)):
+            elapsed, counts = run(filename, reuse, args.keep)
+            print('%-20s %8.2f s %10.0f records/s  gc collections (gen0/1/2): %d/%d/%d' %
+                  (name, elapsed, args.lines / elapsed, counts[0], counts[1], counts[2]))
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,380 @@
+# Check that the Python reader decodes IMMA records the same way as the
+#  R, Perl and JavaScript readers, and measure its speed
+#
+# Usage: python benchmarks/parity.py [--corpus ../R/IMMA/inst/extdata/tests]
+#                                    [--readers perl js r] [--live | --update]
+#                                    [--synthetic 100000 [1000000 ...]]
+#                                    [--attachments 0,1,99] [--output results.json]
+#
+# Each .imma file in the corpus is decoded with IMMA.read and compared,
+# field by field, with the values decoded by each of the other readers.
+# Those are stored as CSV in benchmarks/reference (<file>.<reader>.csv,
+# one row per record, missing values as empty cells) and made by the
+# dump.pl, dump.js and dump.R scripts there (and export_rdata.R for the R
+# package's .Rdata fixtures). --live runs the scripts instead of using the
+# stored files, and --update stores what they make.
+#
+# Synthetic files (from IMMA.synthetic) are always compared with live
+# output, from whichever of the other readers are installed.
+#
+# Numbers are compared with a small relative tolerance and characters
+# with surrounding blanks removed (R removes leading blanks). Lines the
+# Python reader can't decode (unsupported attachments) are reported, not
+# compared. Results, including the Python decode rate for each file, are
+# written as JSON; the exit status is 1 if there were any differences.
+#
+# Known differences - bugs in the other readers - are listed, by reader and
+# parameter, in benchmarks/reference/expected.json. They are still counted
+# and reported, but don't change the exit status. Readers with no stored
+# output (and, with --live, readers that aren't installed) are reported as
+# having no reference.
+
+import argparse
+import csv
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import IMMA
+from IMMA.synthetic import generate
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CORPUS = os.path.join(HERE, '..', '..', 'R', 'IMMA', 'inst', 'extdata', 'tests')
+REFERENCE = os.path.join(HERE, 'reference')
+EXPECTED = os.path.join(REFERENCE, 'expected.json')
+
+# How to run each of the other readers: reader -> (program, script)
+READERS = {'perl': ('perl', 'dump.pl'),
+           'js': ('node', 'dump.js'),
+           'r': ('Rscript', 'dump.R')}
+
+# Relative tolerance for numeric values
+TOLERANCE = 1e-9
+
+# Examples of differences kept for each parameter
+EXAMPLES = 5
+
+
+def encoding(p):
+    # Encoding of a parameter (1 integer, 2 base36, 3 characters), None if unknown
+    for attachment in sorted(IMMA.definitions):
+        if p in IMMA.definitions[attachment]:
+            return IMMA.definitions[attachment][p][6]
+    return None
+
+
+def same(value, reference, kind):
+    """
+    Are a Python value and a reference value (a string from CSV, or None) the same?
+
+    :param value: Decoded by IMMA.read
+    :param reference: From the reference CSV
+    :type reference: str
+    :param kind: Encoding of the parameter
+    :type kind: int
+
+    :rtype: bool
+    """
+    if reference is None or value is None:
+        return reference is None and value is None
+    if kind == 3:
+        return str(value).strip() == reference.strip()
+    try:
+        reference = float(reference)
+    except ValueError:
+        return False
+    return abs(value - reference) <= TOLERANCE * max(1.0, abs(reference))
+
+
+def load_reference(fh):
+    """
+    Read a reference CSV
+
+    :return: (parameters, rows) - each row a dict, with None for empty cells
+    """
+    reader = csv.reader(fh)
+    header = next(reader)
+    rows = []
+    for row in reader:
+        rows.append(dict((p, v if v != '' else None) for p, v in zip(header, row)))
+    return [p for p in header if p not in ('_error', 'attachments')], rows
+
+
+def run_reader(reader, filename):
+    """
+    Decode a file with one of the other readers
+
+    :param reader: 'perl', 'js' or 'r'
+    :type reader: str
+    :param filename: The IMMA file
+    :type filename: str
+
+    :return: The reference CSV (or None if the reader isn't installed)
+    :rtype: str
+    """
+    program, script = READERS[reader]
+    if shutil.which(program) is None:
+        return None
+    with open(filename, 'rb') as fh:
+        result = subprocess.run([program, os.path.join(REFERENCE, script)], stdin=fh,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return result.stdout.decode('latin-1')
+
+
+def decode(filename):
+    """
+    Decode a file with the Python reader
+
+    :return: list with an IMMA record, or the error message, for each line
+    """
+    result = []
+    with open(filename, encoding='latin-1') as fh:
+        for line in fh:
+            try:
+                result.append(IMMA.read(line))
+            except Exception as e:
+                result.append(str(e))
+    return result
+
+
+def decode_rate(filename):
+    # Time a plain pass over the file - nothing but decoding
+    n = 0
+    start = time.perf_counter()
+    with open(filename, encoding='latin-1') as fh:
+        for line in fh:
+            try:
+                IMMA.read(line)
+            except Exception:
+                pass
+            n += 1
+    elapsed = time.perf_counter() - start
+    return {'records': n,
+            'seconds': elapsed,
+            'records_per_second': n / elapsed if elapsed > 0 else None,
+            'bytes_per_second': os.path.getsize(filename) / elapsed if elapsed > 0 else None}
+
+
+def load_expected(filename):
+    """
+    Read the list of known differences
+
+    :return: reader -> set of parameters expected to differ
+    :rtype: dict
+    """
+    if not filename or not os.path.exists(filename):
+        return {}
+    with open(filename) as fh:
+        return dict((reader, set(known['parameters'])) for reader, known in json.load(fh).items())
+
+
+def compare(records, params, rows, expected=()):
+    """
+    Compare the Python records with the rows of a reference
+
+    :param records: From decode
+    :param params: Parameters in the reference
+    :param rows: Reference rows
+    :type rows: list of dict
+    :param expected: Parameters known to differ (counted separately)
+    :type expected: set
+
+    :return: Summary of the differences
+    :rtype: dict
+    """
+    result = {'records': len(rows),
+              'fields': 0,
+              'differences': 0,
+              'by_parameter': {},
+              'expected_differences': 0,  # In the expected parameters
+              'expected_by_parameter': {},
+              'examples': {},
+              'python_only_errors': 0,  # Lines only the Python reader couldn't decode
+              'reference_only_errors': 0,
+              'both_errors': 0,
+              'not_in_python': [p for p in params if encoding(p) is None]}
+    if len(rows) != len(records):
+        result['record_count'] = {'python': len(records), 'reference': len(rows)}
+    known = [(p, encoding(p)) for p in params if encoding(p) is not None]
+    for line, (record, row) in enumerate(zip(records, rows), 1):
+        failed = isinstance(record, str)
+        if row.get('_error') is not None:
+            if failed:
+                result['both_errors'] += 1
+            else:
+                result['reference_only_errors'] += 1
+            continue
+        if failed:
+            result['python_only_errors'] += 1
+            continue
+        if row.get('attachments') is not None:
+            if [int(a) for a in row['attachments'].split()] != record.attachments:
+                result['by_parameter']['attachments'] = result['by_parameter'].get('attachments', 0) + 1
+        for p, kind in known:
+            result['fields'] += 1
+            value = record.data.get(p)
+            if same(value, row[p], kind):
+                continue
+            if p in expected:
+                result['expected_differences'] += 1
+                result['expected_by_parameter'][p] = result['expected_by_parameter'].get(p, 0) + 1
+                continue
+            result['differences'] += 1
+            result['by_parameter'][p] = result['by_parameter'].get(p, 0) + 1
+            examples = result['examples'].setdefault(p, [])
+            if len(examples) < EXAMPLES:
+                examples.append({'line': line, 'python': value, 'reference': row[p]})
+    return result
+
+
+def check(filename, readers, reference_dir, live, update, expected=None):
+    """
+    Compare the Python reader with the others on one file
+
+    :param filename: The IMMA file
+    :param readers: The other readers to compare with
+    :param reference_dir: Where the stored reference CSVs are
+    :param live: Run the other readers rather than using the stored output
+    :param update: Store the output of the other readers
+    :param expected: reader -> parameters known to differ (from load_expected)
+
+    :return: Results for the file
+    :rtype: dict
+    """
+    records = decode(filename)
+    result = {'file': os.path.basename(filename),
+              'records': len(records),
+              'python_errors': sorted(set(r for r in records if isinstance(r, str))),
+              'decode': decode_rate(filename),
+              'references': {}}
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    for reader in readers:
+        stored = os.path.join(reference_dir, '%s.%s.csv' % (stem, reader))
+        if live or update:
+            try:
+                text = run_reader(reader, filename)
+            except subprocess.CalledProcessError as e:
+                result['references'][reader] = {'failed': e.stderr.decode('latin-1').strip()}
+                continue
+            if text is None:
+                result['references'][reader] = {'missing': '%s is not installed' % READERS[reader][0]}
+                continue
+            if update:
+                with open(stored, 'w', encoding='latin-1', newline='') as fh:
+                    fh.write(text)
+        elif os.path.exists(stored):
+            with open(stored, encoding='latin-1', newline='') as fh:
+                text = fh.read()
+        else:
+            result['references'][reader] = {'missing': 'no stored reference'}
+            continue
+        params, rows = load_reference(io.StringIO(text, newline=''))
+        result['references'][reader] = compare(records, params, rows, (expected or {}).get(reader, ()))
+    return result
+
+
+def differences(result):
+    # Number of differences in the results for a file, leaving out expected ones
+    n = 0
+    for reference in result['references'].values():
+        n += reference.get('differences', 0) + reference.get('python_only_errors', 0)
+        n += reference.get('reference_only_errors', 0)
+        n += reference.get('by_parameter', {}).get('attachments', 0)
+        n += 1 if 'record_count' in reference or 'failed' in reference else 0
+    return n
+
+
+def summary(result):
+    lines = ['%s: %d records, %.0f records/s' % (result['file'], result['records'],
+                                                 result['decode']['records_per_second'] or 0)]
+    for reader, reference in sorted(result['references'].items()):
+        if 'failed' in reference:
+            lines.append('  %-4s failed: %s' % (reader, reference['failed']))
+            continue
+        if 'missing' in reference:
+            lines.append('  %-4s no reference (%s)' % (reader, reference['missing']))
+            continue
+        line = '  %-4s %d/%d fields differ' % (reader, reference['differences'], reference['fields'])
+        worst = sorted(reference['by_parameter'].items(), key=lambda x: -x[1])[:5]
+        if len(worst) > 0:
+            line += ' (%s)' % ', '.join('%s %d' % w for w in worst)
+        if reference['expected_differences'] > 0:
+            line += ', %d expected differences in %d parameters' % (
+                reference['expected_differences'], len(reference['expected_by_parameter']))
+        skipped = (reference['python_only_errors'] + reference['reference_only_errors'] +
+                   reference['both_errors'])
+        if skipped > 0:
+            line += ', %d lines not compared' % skipped
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the Python IMMA reader with the R, Perl and JavaScript readers')
+    parser.add_argument('--corpus', default=CORPUS,
+                        help='Directory of .imma files (default is the R package test files)')
+    parser.add_argument('--reference', default=REFERENCE,
+                        help='Directory of reference CSVs')
+    parser.add_argument('--expected', default=EXPECTED,
+                        help="JSON list of known differences, by reader and parameter ('' for none)")
+    parser.add_argument('--readers', nargs='+', default=sorted(READERS), choices=sorted(READERS),
+                        help='Readers to compare with')
+    parser.add_argument('--live', action='store_true',
+                        help='Run the other readers on the corpus, rather than using the stored output')
+    parser.add_argument('--update', action='store_true',
+                        help='Run the other readers on the corpus and store their output')
+    parser.add_argument('--synthetic', type=int, nargs='*', default=[],
+                        help='Also compare on synthetic files of these numbers of records')
+    parser.add_argument('--attachments', default='0,1,99',
+                        help='Attachments in the synthetic records (comma-separated IDs)')
+    parser.add_argument('--output', default=None,
+                        help='File for the JSON results (default is standard output)')
+    parser.add_argument('--tmpdir', default=None,
+                        help='Directory for the synthetic files')
+    args = parser.parse_args()
+
+    results = {'python': platform.python_version(),
+               'platform': platform.platform(),
+               'date': datetime.datetime.utcnow().isoformat(),
+               'results': []}
+    expected = load_expected(args.expected)
+    for name in sorted(os.listdir(args.corpus)):
+        if name.endswith('.imma'):
+            results['results'].append(check(os.path.join(args.corpus, name), args.readers,
+                                            args.reference, args.live, args.update, expected))
+
+    attachments = tuple(int(a) for a in args.attachments.split(','))
+    for size in args.synthetic:
+        fd, filename = tempfile.mkstemp(suffix='.imma', dir=args.tmpdir)
+        os.close(fd)
+        try:
+            with open(filename, 'w') as fh:
+                generate(fh, size, attachments, seed=size)
+            result = check(filename, args.readers, args.reference, True, False, expected)
+            result['file'] = 'synthetic %d (%s)' % (size, args.attachments)
+            results['results'].append(result)
+        finally:
+            os.remove(filename)
+
+    for result in results['results']:
+        sys.stderr.write(summary(result) + '\n')
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+    return 1 if sum(differences(result) for result in results['results']) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
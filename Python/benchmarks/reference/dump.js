@@ -0,0 +1,44 @@
+// Decode an IMMA file with the JavaScript reader (JavaScript/IMMA.js) and
+//  write the values as CSV, for comparison by benchmarks/parity.py
+//
+// Usage: node dump.js < file.imma > file.js.csv
+//
+// One row per input line: the first column (_error) is empty unless the
+//  line couldn't be decoded; missing values are empty cells.
+
+var fs = require('fs');
+var path = require('path');
+var vm = require('vm');
+
+// IMMA.js is written for browsers - load it as a script, not a module
+vm.runInThisContext(fs.readFileSync(
+    path.join(__dirname, '..', '..', '..', 'JavaScript', 'IMMA.js'), 'latin1'));
+
+var columns = [];
+for (var i = 0; i < IMMA.parameters.length; i++) {
+    if (IMMA.parameters[i] != null) {
+        columns = columns.concat(IMMA.parameters[i]);
+    }
+}
+
+function quote(value) {
+    if (value == null) { return ''; }
+    return '"' + String(value).replace(/"/g, '""') + '"';
+}
+
+var output = [['_error', 'attachments'].concat(columns).join(',')];
+var lines = fs.readFileSync(0, 'latin1').split('\n');
+if (lines[lines.length - 1] == '') { lines.pop(); }
+lines.forEach(function(line) {
+    var row;
+    try {
+        var record = new IMMA(line.replace(/\r$/, ''));
+        row = ['', quote(record.attachments.join(' '))];
+        columns.forEach(function(p) { row.push(quote(record[p])); });
+    } catch (e) {
+        row = [quote(e.message), ''];
+        columns.forEach(function() { row.push(''); });
+    }
+    output.push(row.join(','));
+});
+process.stdout.write(output.join('\n') + '\n', 'latin1');
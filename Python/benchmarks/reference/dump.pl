@@ -0,0 +1,47 @@
+#!/usr/bin/perl
+# Decode an IMMA file with the Perl reader (MarineOb::IMMA) and write the
+#  values as CSV, for comparison by benchmarks/parity.py
+#
+# Usage: perl dump.pl < file.imma > file.perl.csv
+#
+# One row per input line: the first column (_error) is empty unless the
+#  line couldn't be decoded; missing values are empty cells.
+
+use strict;
+use warnings;
+use FindBin;
+use lib "$FindBin::Bin/../../../Perl";
+use MarineOb::IMMA;
+
+$SIG{__WARN__} = sub { };    # Range check warnings aren't of interest here
+
+my @Columns;
+for ( my $i = 0 ; $i < scalar(@MarineOb::IMMA::parameters) ; $i++ ) {
+    next unless defined( $MarineOb::IMMA::parameters[$i] );
+    push @Columns, @{ $MarineOb::IMMA::parameters[$i] };
+}
+
+sub quote {
+    my $Value = shift;
+    unless ( defined($Value) ) { return ''; }
+    $Value =~ s/"/""/g;
+    return "\"$Value\"";
+}
+
+print join( ',', '_error', 'attachments', @Columns ) . "\n";
+while ( my $Line = <STDIN> ) {
+    my $Record = new MarineOb::IMMA;
+    open( my $fh, '<', \$Line ) or die;
+    my @Row;
+    if ( eval { $Record->read($fh) } ) {
+        push @Row, '', quote( join( ' ', @{ $Record->{attachments} } ) );
+        push @Row, quote( $Record->{$_} ) foreach @Columns;
+    }
+    else {
+        my $Error = $@;
+        $Error =~ s/ at .*//s;
+        push @Row, quote($Error), '';
+        push @Row, '' foreach @Columns;
+    }
+    print join( ',', @Row ) . "\n";
+}
@@ -0,0 +1,141 @@
+# Benchmarks for the IMMA.read/IMMA.write hot path, on synthetic files
+#
+# Usage: python benchmarks/run.py [--sizes 10000 1000000 10000000]
+#                                 [--attachments 0,1,99 [0,1 ...]] [--output results.json]
+#
+# For each size a file of random (valid) records is made with IMMA.synthetic,
+# and the decode, encode and round-trip rates and the memory per decoded
+# record are measured. Results are written as JSON.
+
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import IMMA
+from IMMA.synthetic import generate
+
+# Number of different records in each synthetic file
+DISTINCT = 1000
+
+# Number of records held in memory to measure the memory per record
+MEMORY_RECORDS = 10000
+
+
+def rate(n, nbytes, elapsed):
+    return {'seconds': elapsed,
+            'records_per_second': n / elapsed if elapsed > 0 else None,
+            'bytes_per_second': nbytes / elapsed if elapsed > 0 else None}
+
+
+def bench_decode(filename):
+    n = 0
+    start = time.perf_counter()
+    with open(filename) as fh:
+        for line in fh:
+            IMMA.read(line)
+            n += 1
+    return n, time.perf_counter() - start
+
+
+def bench_encode(filename, n):
+    # Decode a pool of records, then time writing n records from it
+    with open(filename) as fh:
+        pool = [IMMA.read(line) for line, i in zip(fh, range(DISTINCT))]
+    with open(os.devnull, 'w') as sink:
+        start = time.perf_counter()
+        for i in range(n):
+            pool[i % len(pool)].write(sink)
+        return time.perf_counter() - start
+
+
+def bench_round_trip(filename):
+    # Read and write every record, and count those that don't come back the same
+    mismatches = 0
+    buffer = io.StringIO()
+    start = time.perf_counter()
+    with open(filename) as fh:
+        for line in fh:
+            buffer.seek(0)
+            buffer.truncate()
+            IMMA.read(line).write(buffer)
+            if buffer.getvalue() != line:
+                mismatches += 1
+    return time.perf_counter() - start, mismatches
+
+
+def bench_memory(filename):
+    with open(filename) as fh:
+        lines = [line for line, i in zip(fh, range(MEMORY_RECORDS))]
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        records = [IMMA.read(line) for line in lines]
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return (after - before) / len(records)
+
+
+def run(size, attachments, directory):
+    fd, filename = tempfile.mkstemp(suffix='.imma', dir=directory)
+    os.close(fd)
+    try:
+        with open(filename, 'w') as fh:
+            generate(fh, size, attachments, seed=size, distinct=DISTINCT)
+        nbytes = os.path.getsize(filename)
+
+        n, elapsed = bench_decode(filename)
+        result = {'size': size,
+                  'attachments': list(attachments),
+                  'bytes': nbytes,
+                  'decode': rate(n, nbytes, elapsed)}
+        result['encode'] = rate(n, nbytes, bench_encode(filename, n))
+        elapsed, mismatches = bench_round_trip(filename)
+        result['round_trip'] = rate(n, nbytes, elapsed)
+        result['round_trip']['mismatches'] = mismatches
+        result['memory_per_record'] = bench_memory(filename)
+        return result
+    finally:
+        os.remove(filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark IMMA decoding and encoding')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000],
+                        help='Numbers of records (e.g. 10000 1000000 10000000)')
+    parser.add_argument('--attachments', nargs='+', default=['0,1,99'],
+                        help='Attachment mixes, each a comma-separated list of attachment IDs')
+    parser.add_argument('--output', default=None,
+                        help='File for the JSON results (default is standard output)')
+    parser.add_argument('--tmpdir', default=None,
+                        help='Directory for the synthetic files')
+    args = parser.parse_args()
+
+    results = {'python': platform.python_version(),
+               'platform': platform.platform(),
+               'date': datetime.datetime.utcnow().isoformat(),
+               'results': []}
+    for attachments in args.attachments:
+        attachments = tuple(int(a) for a in attachments.split(','))
+        for size in args.sizes:
+            results['results'].append(run(size, attachments, args.tmpdir))
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+from setuptools import setup
+
+setup(
+    name='IMMA',
+    description='Tools for International Maritime Meteorological Archive records',
+    url='https://github.com/gf-atebbe/IMMA',
+    license='Apache License 2.0',
+    packages=['IMMA'],
+    extras_require={
+        'pandas': ['pandas'],
+        'numpy': ['numpy'],
+        'parquet': ['pandas', 'pyarrow'],
+        'arrow': ['pyarrow'],
+    },
+    entry_points={
+        'console_scripts': ['imma=IMMA.cli:main'],
+    },
+)
@@ -0,0 +1,80 @@
+# Tests of the imma command
+#
+# Usage: python -m pytest tests (or python -m unittest discover tests)
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from IMMA import cli
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CORPUS = os.path.join(HERE, '..', '..', 'R', 'IMMA', 'inst', 'extdata', 'tests')
+
+
+class TestCommands(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(os.path.join(CORPUS, 'basic.imma'), encoding='latin-1') as fh:
+            self.lines = [line for line in fh if len(line.strip()) > 0]
+        # The last line of the first file has no newline
+        self.files = [os.path.join(self.directory, 'a.imma'), os.path.join(self.directory, 'b.imma')]
+        with open(self.files[0], 'w', encoding='latin-1') as fh:
+            fh.write(''.join(self.lines[:3]).rstrip('\n'))
+        with open(self.files[1], 'w', encoding='latin-1') as fh:
+            fh.write(''.join(self.lines[3:5]))
+        self.output = os.path.join(self.directory, 'out.imma')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_command(self, *argv):
+        self.assertEqual(cli.main(list(argv) + ['-j', '1', '-o', self.output] + self.files), 0)
+        with open(self.output, encoding='latin-1') as fh:
+            return fh.readlines()
+
+    def test_filter_last_line(self):
+        self.assertEqual(self.run_command('filter', '-w', 'YR>0'), self.lines[:5])
+
+    def test_sort_last_line(self):
+        for buffer in ('1000', '2'):  # In memory, and merged from runs on disc
+            result = self.run_command('sort', '-k', 'SST', '-b', buffer)
+            self.assertEqual(sorted(result), sorted(self.lines[:5]))
+
+    def test_usage_errors(self):
+        for argv in (['filter'], ['filter', '-w', 'SST'], ['cut', '-p', 'YR', '-w', 'NOTAPARAMETER>1'],
+                     ['cut', '-p', 'YR', '-w', 'YR>']):
+            with self.assertRaises(SystemExit) as context:
+                with open(os.devnull, 'w') as devnull:
+                    stderr, sys.stderr = sys.stderr, devnull
+                    try:
+                        cli.main(argv + self.files)
+                    finally:
+                        sys.stderr = stderr
+            self.assertEqual(context.exception.code, 2)
+
+    def test_non_ascii_passes_through(self):
+        # A byte that isn't ASCII in SUPD comes out unchanged, on standard output
+        #  (whatever the locale) and in a file
+        data = (self.lines[0].rstrip('\n') + '\xe9\xe9\xe9\n').encode('latin-1') + \
+            ''.join(self.lines[1:3]).encode('latin-1')
+        with open(self.files[0], 'wb') as fh:
+            fh.write(data)
+        for command in (['filter', '-w', 'YR>0'], ['sort', '-k', 'YR']):
+            result = subprocess.run([sys.executable, '-m', 'IMMA.cli'] + command + ['-j', '1', self.files[0]],
+                                    stdout=subprocess.PIPE, check=True, cwd=os.path.join(HERE, '..'),
+                                    env=dict(os.environ, LC_ALL='C', PYTHONIOENCODING=''))
+            self.assertEqual(sorted(result.stdout.splitlines()), sorted(data.splitlines()))
+            cli.main(command + ['-j', '1', '-o', self.output, self.files[0]])
+            with open(self.output, 'rb') as fh:
+                self.assertEqual(fh.read(), result.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# Tests of the derived variables: the numpy and pure-Python versions agree
+#
+# Usage: python -m pytest tests (or python -m unittest discover tests)
+
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from IMMA import derived
+
+# Parameter -> function making a random value for it
+VALUES = {'D': lambda: random.choice([361, 362] + list(range(1, 361))),
+          'W': lambda: random.uniform(0, 40),
+          'WI': lambda: random.randint(0, 8),
+          'AT': lambda: random.uniform(-20, 35),
+          'DPT': lambda: random.uniform(-25, 25),
+          'WBT': lambda: random.uniform(-20, 30),
+          'SST': lambda: random.uniform(-2, 30),
+          'SLP': lambda: random.uniform(950, 1040),
+          'LAT': lambda: random.uniform(-90, 90),
+          'A': lambda: random.randint(0, 8),
+          'PPP': lambda: random.uniform(0, 5)}
+
+
+class TestDerived(unittest.TestCase):
+
+    def columns(self, n=2000):
+        random.seed(n)
+        return dict((p, [None if random.random() < 0.1 else value() for i in range(n)])
+                    for p, value in VALUES.items())
+
+    @unittest.skipIf(derived.numpy is None, 'numpy is not installed')
+    def test_numpy_matches_python(self):
+        columns = self.columns()
+        names = sorted(derived.registry)
+        vector = derived.compute(dict(columns), names)
+        numpy, derived.numpy = derived.numpy, None
+        try:
+            scalar = derived.compute(dict(columns), names)
+        finally:
+            derived.numpy = numpy
+        for name in names:
+            for x, y in zip(vector[name], scalar[name]):
+                self.assertEqual(x is None, y is None, name)
+                if y is not None:
+                    self.assertEqual(type(x), type(y), name)
+                    self.assertAlmostEqual(x, y, delta=1e-9 * max(1.0, abs(y)), msg=name)
+
+    def test_inputs_are_parameters(self):
+        for name in derived.registry:
+            for p in derived.expand([name]):
+                self.assertIn(p, VALUES, name)
+
+    def test_calm_and_variable(self):
+        values = derived.compute({'D': [361, 362, 90, None], 'W': [0.0, 3.0, 2.0, 2.0]}, ['U', 'V'])
+        self.assertEqual(values['U'][:2], [0.0, None])
+        self.assertAlmostEqual(values['U'][2], -2.0)
+        self.assertIsNone(values['V'][3])
+
+    def test_parameter_name_rejected(self):
+        self.assertRaises(Exception, derived.register, 'SST', ('AT',))
+
+
+if __name__ == '__main__':
+    unittest.main()
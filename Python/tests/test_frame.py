@@ -0,0 +1,63 @@
+# Tests of reading IMMA files into pandas DataFrames
+#
+# Usage: python -m pytest tests (or python -m unittest discover tests)
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import IMMA
+
+try:
+    import pandas
+except ImportError:  # The tests are skipped
+    pandas = None
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', 'R', 'IMMA', 'inst', 'extdata', 'tests')
+
+
+@unittest.skipIf(pandas is None, 'pandas is not installed')
+class TestDataFrame(unittest.TestCase):
+
+    filename = os.path.join(CORPUS, 'mixed_attachments.imma')
+    params = ['YR', 'HR', 'SST', 'DCK', 'ID', 'SUPD', 'SF']
+
+    def expected(self):
+        with IMMA.open_file(self.filename) as fh:
+            return IMMA.columns(fh, self.params)
+
+    def check(self, frame, expected):
+        for p in self.params:
+            values = [None if pandas.isna(v) else v for v in frame[p]]
+            self.assertEqual(values, expected[p], p)
+
+    def test_columns_match(self):
+        self.check(IMMA.to_dataframe(self.filename, params=self.params), self.expected())
+
+    def test_chunks_match(self):
+        frames = list(IMMA.to_dataframe(self.filename, params=self.params, chunksize=3))
+        self.assertEqual([len(frame) for frame in frames], [3, 3, 3, 1])
+        self.assertEqual(list(frames[-1].index), [9])
+        self.check(pandas.concat(frames), self.expected())
+
+    def test_dtypes(self):
+        frame = IMMA.to_dataframe(self.filename, params=self.params)
+        self.assertEqual(str(frame['YR'].dtype), 'Int32')
+        self.assertEqual(str(frame['HR'].dtype), 'float64')
+        self.assertEqual(str(frame['SST'].dtype), 'float64')
+        self.assertEqual(str(frame['DCK'].dtype), 'Int32')
+        self.assertEqual(str(frame['SF'].dtype), 'Int32')
+        self.assertEqual(str(frame['ID'].dtype), 'category')
+        self.assertEqual(str(frame['SUPD'].dtype), 'string')
+
+    def test_where(self):
+        frame = IMMA.to_dataframe(self.filename, params=['YR', 'SST'],
+                                  where=lambda record: record['SST'] is not None)
+        self.assertFalse(frame['SST'].isna().any())
+
+
+if __name__ == '__main__':
+    unittest.main()
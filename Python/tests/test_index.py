@@ -0,0 +1,56 @@
+# Tests of line-offset indexes
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from IMMA.index import index_filename, load_index, read_lines
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', 'R', 'IMMA', 'inst', 'extdata', 'tests')
+
+
+class TestIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'basic.imma')
+        shutil.copy(os.path.join(CORPUS, 'basic.imma'), self.filename)
+
+    def tearDown(self):
+        os.chmod(self.directory, stat.S_IRWXU)
+        shutil.rmtree(self.directory)
+
+    def test_read_lines(self):
+        offsets = load_index(self.filename)
+        self.assertTrue(os.path.exists(index_filename(self.filename)))
+        with open(self.filename, encoding='latin-1') as fh:
+            lines = fh.readlines()
+        self.assertEqual(len(offsets), len(lines))
+        for position, line in read_lines(self.filename, offsets, [42, 0, 99]):
+            self.assertEqual(line, lines[position])
+
+    def test_index_directory(self):
+        indexes = tempfile.mkdtemp()
+        try:
+            offsets = load_index(self.filename, directory=indexes)
+            self.assertFalse(os.path.exists(index_filename(self.filename)))
+            self.assertTrue(os.path.exists(index_filename(self.filename, indexes)))
+            self.assertEqual(list(load_index(self.filename, build=False, directory=indexes)), list(offsets))
+        finally:
+            shutil.rmtree(indexes)
+
+    def test_read_only(self):
+        os.chmod(self.directory, stat.S_IRUSR | stat.S_IXUSR)
+        if os.access(self.directory, os.W_OK):  # e.g. running as root
+            self.skipTest("Directory can't be made read-only")
+        self.assertEqual(len(load_index(self.filename)), 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
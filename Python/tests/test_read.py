@@ -0,0 +1,115 @@
+# Tests of reading and writing IMMA records, on the R package's test files
+#
+# Usage: python -m pytest tests (or python -m unittest discover tests)
+
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import IMMA
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', 'R', 'IMMA', 'inst', 'extdata', 'tests')
+
+
+def corpus_lines(name):
+    with open(os.path.join(CORPUS, name), encoding='latin-1') as fh:
+        return [line for line in fh if len(line.strip()) > 0]
+
+
+class TestRoundTrip(unittest.TestCase):
+
+    def check_file(self, name):
+        for line in corpus_lines(name):
+            buffer = io.StringIO()
+            IMMA.read(line).write(buffer)
+            self.assertEqual(buffer.getvalue(), line.rstrip('\n').rstrip() + '\n')
+
+    def test_basic(self):
+        self.check_file('basic.imma')
+
+    def test_mixed_attachments(self):
+        self.check_file('mixed_attachments.imma')
+
+    def test_unsupported_attachment(self):
+        # Attachment 7 isn't supported
+        line = corpus_lines('IMMA1_0+1+5+6+7+8+9+98+99.imma')[0]
+        self.assertRaises(Exception, IMMA.read, line)
+
+
+class TestSupplemental(unittest.TestCase):
+
+    def test_header_not_in_data(self):
+        # The 4-character attachment 99 header ('99 0') isn't part of ATTE or SUPD
+        line = corpus_lines('basic.imma')[0]
+        record = IMMA.read(line)
+        self.assertEqual(record.attachments, [0, 1, 99])
+        self.assertIsNone(record['ATTE'])
+        self.assertTrue(record['SUPD'].startswith('430167118500101  5034N 3957W'))
+        self.assertTrue(record['SUPD'].endswith('NEW YORK                 2762 199'))
+
+    def test_supd_is_rest_of_line(self):
+        for line in corpus_lines('basic.imma') + corpus_lines('mixed_attachments.imma'):
+            line = line.rstrip('\n')
+            record = IMMA.read(line)
+            if 99 not in record.attachments:
+                continue
+            start = line.index('99 0', 108)
+            self.assertEqual(record['ATTE'], IMMA.decode_value(line[start + 4], IMMA.definitions['99']['ATTE']))
+            self.assertEqual(record['SUPD'], line[start + 5:])
+
+
+class TestPeek(unittest.TestCase):
+
+    def test_peek_matches_read(self):
+        for name in ('basic.imma', 'mixed_attachments.imma'):
+            for line in corpus_lines(name):
+                record = IMMA.read(line)
+                params = [p for attachment in record.attachments
+                          for p in IMMA.get_parameters(attachment)]
+                self.assertEqual(IMMA.peek(line, params), dict((p, record[p]) for p in params))
+
+    def test_peek_missing_attachment(self):
+        # Parameters of attachments the record doesn't have are None
+        line = corpus_lines('basic.imma')[0]
+        record = IMMA.read(line)
+        missing = [p for p in IMMA.get_parameters(5)]
+        self.assertNotIn(5, record.attachments)
+        for value in IMMA.peek(line, missing).values():
+            self.assertIsNone(value)
+
+
+class TestRecords(unittest.TestCase):
+
+    params = ['YR', 'SST', 'DCK', 'SF', 'SUPD', 'WI']
+
+    def test_columns_match_read(self):
+        lines = corpus_lines('basic.imma') + corpus_lines('mixed_attachments.imma')
+        values = IMMA.columns(lines, self.params)
+        for p in self.params:
+            self.assertEqual(values[p], [IMMA.read(line).data.get(p) for line in lines])
+
+    def test_projection_reuses_record(self):
+        lines = corpus_lines('mixed_attachments.imma')
+        for where in (None, lambda record: record['YR'] is not None):
+            seen = set()
+            for record in IMMA.records(lines, self.params, where, reuse=True):
+                seen.add(id(record.data))
+                self.assertEqual(sorted(record.data), sorted(self.params))
+            self.assertEqual(len(seen), 1)
+
+
+class TestRounding(unittest.TestCase):
+
+    def test_negative(self):
+        self.assertEqual(IMMA.nint(-1.7 / 0.1), -17)
+        self.assertEqual(IMMA.nint(-2.5), -2)
+        self.assertEqual(IMMA.nint(2.5), 2)
+        self.assertEqual(IMMA.nint(2.6), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+# Tests of record sampling
+#
+# Usage: python -m pytest tests (or python -m unittest discover tests)
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import IMMA
+from IMMA.index import line_offsets
+from IMMA.sample import sample
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', 'R', 'IMMA', 'inst', 'extdata', 'tests')
+
+
+class TestSample(unittest.TestCase):
+
+    def setUp(self):
+        # The test records, with the year of the first ten blanked
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'sample.imma')
+        with open(os.path.join(CORPUS, 'basic.imma'), encoding='latin-1') as fh:
+            self.lines = [line for line in fh if len(line.strip()) > 0]
+        self.lines = ['    ' + line[4:] for line in self.lines[:10]] + self.lines[10:]
+        with open(self.filename, 'w', encoding='latin-1') as fh:
+            fh.write(''.join(self.lines))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_uniform(self):
+        data = [IMMA.read(line).data for line in self.lines]
+        for offsets in (None, line_offsets(self.filename)):
+            records = sample(self.filename, 20, offsets=offsets, seed=1)
+            self.assertEqual(len(records), 20)
+            for record in records:
+                self.assertIn(record.data, data)
+
+    def test_stratified_with_missing_year(self):
+        decade = lambda v: (v['YR'] // 10 if v['YR'] is not None else None, v['DCK'])
+        strata = sample(self.filename, 5, by=['YR', 'DCK'], key=decade, seed=1)
+        counts = {}
+        for line in self.lines:
+            values = IMMA.peek(line, ['YR', 'DCK'])
+            counts[decade(values)] = counts.get(decade(values), 0) + 1
+        self.assertEqual(sorted(strata, key=str), sorted(counts, key=str))
+        self.assertTrue(any(stratum[0] is None for stratum in strata))
+        for stratum, records in strata.items():
+            self.assertEqual(len(records), min(5, counts[stratum]))
+            for record in records:
+                self.assertEqual(decade(record.data), stratum)
+
+
+if __name__ == '__main__':
+    unittest.main()
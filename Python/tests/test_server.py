@@ -0,0 +1,211 @@
+# Tests of the query server: its file set (including files that change while
+#  served), and HTTP requests to it on localhost, over TCP and a Unix socket
+#
+# Usage: python -m pytest tests (or python -m unittest discover tests)
+
+import http.client
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.parse
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import IMMA
+from IMMA.server import BlockCache, FileSet, Query, QueryServer, UnixQueryServer
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', 'R', 'IMMA', 'inst', 'extdata', 'tests')
+
+
+class TestChangingFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.indexes = os.path.join(self.directory, 'indexes')
+        os.mkdir(self.indexes)
+        with open(os.path.join(CORPUS, 'basic.imma'), encoding='latin-1') as fh:
+            self.lines = fh.readlines()
+        self.filename = os.path.join(self.directory, 'basic.imma')
+        self.write(self.lines)
+        self.fileset = FileSet([self.filename], block_size=10, directory=self.indexes)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, lines):
+        with open(self.filename, 'w', encoding='latin-1') as fh:
+            fh.write(''.join(lines))
+
+    def count(self):
+        return len(list(self.fileset.query(Query())))
+
+    def test_index_directory(self):
+        self.assertEqual(sorted(os.listdir(self.indexes)), ['basic.imma.blocks', 'basic.imma.idx'])
+        self.assertEqual(sorted(os.listdir(self.directory)), ['basic.imma', 'indexes'])
+
+    def test_grow_and_shrink(self):
+        self.assertEqual(self.count(), 100)
+        self.write(self.lines + self.lines[:20])
+        self.assertEqual(self.count(), 120)
+        self.write(self.lines[:33])
+        self.assertEqual(self.count(), 33)
+        self.assertEqual(self.fileset.cache.stats()['records'], 33)
+
+    def test_shorter_than_index(self):
+        # A change the size and time don't show: reading stops at the end, rather than hanging
+        stamp = self.fileset.stamps[0]
+        self.write(self.lines[:55] + [' ' * len(line) for line in self.lines[55:]])
+        self.fileset.stamps[0] = (stamp[0], os.stat(self.filename).st_mtime_ns)
+        result = []
+
+        def query():
+            try:
+                self.count()
+            except Exception as e:
+                result.append(e)
+        thread = threading.Thread(target=query, daemon=True)
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(len(result), 1)
+
+
+class UnixConnection(http.client.HTTPConnection):
+    # HTTP over a Unix socket
+
+    def __init__(self, path):
+        http.client.HTTPConnection.__init__(self, 'localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+class TestHTTP(unittest.TestCase):
+
+    def setUp(self):
+        # The test records all have the same date: spread them over the month
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'spread.imma')
+        with open(os.path.join(CORPUS, 'basic.imma'), encoding='latin-1') as fh:
+            lines = [line for line in fh if len(line.strip()) > 0]
+        with open(self.filename, 'w', encoding='latin-1') as fh:
+            for i, line in enumerate(lines):
+                fh.write(line[:6] + '%2d' % (1 + i % 28) + line[8:])
+        with open(self.filename, encoding='latin-1') as fh:
+            self.values = IMMA.columns(fh, ['DY', 'LAT', 'LON', 'ID'])
+        self.fileset = FileSet([self.filename], block_size=10, cache=BlockCache(1000),
+                               directory=self.directory)
+        self.server = QueryServer(self.fileset, ('127.0.0.1', 0), workers=2, limit=1000)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def get(self, path):
+        url = 'http://%s:%d%s' % (self.server.server_address[0], self.server.server_address[1], path)
+        with urllib.request.urlopen(url, timeout=10) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def status(self, path):
+        try:
+            self.get(path)
+        except urllib.error.HTTPError as e:
+            return e.code
+        return 200
+
+    def records(self, **fields):
+        result = self.get('/records?' + urllib.parse.urlencode(fields))
+        self.assertEqual(result['count'], len(result['records']))
+        return result['records']
+
+    def expected(self, match):
+        return [i for i in range(len(self.values['ID']))
+                if match(*[self.values[p][i] for p in ('DY', 'LAT', 'LON', 'ID')])]
+
+    def check(self, records, match):
+        # The records, in file order, are those matching (and there are some)
+        self.assertGreater(len(records), 0)
+        self.assertEqual([(r['DY'], r['LAT'], r['LON'], r['ID']) for r in records],
+                         [tuple(self.values[p][i] for p in ('DY', 'LAT', 'LON', 'ID'))
+                          for i in self.expected(match)])
+
+    def test_all(self):
+        records = self.records()
+        self.assertEqual(len(records), 100)
+        self.assertEqual(len(self.records(limit=7)), 7)
+
+    def test_box(self):
+        self.check(self.records(box='40,60,300,360'),
+                   lambda dy, lat, lon, id: lat is not None and lon is not None and
+                   40 <= lat <= 60 and 300 <= lon % 360 <= 360)
+        # Across the date line
+        self.check(self.records(box='30,45,340,20'),
+                   lambda dy, lat, lon, id: lat is not None and lon is not None and
+                   30 <= lat <= 45 and (lon % 360 >= 340 or lon % 360 <= 20))
+
+    def test_id(self):
+        self.check(self.records(id='LIBERTY'), lambda dy, lat, lon, id: id is not None and id.strip() == 'LIBERTY')
+
+    def test_period(self):
+        self.check(self.records(start='1850-01-10', end='1850-01-20'),
+                   lambda dy, lat, lon, id: 10 <= dy < 20)
+
+    def test_params(self):
+        records = self.records(id='LIBERTY', params='YR,ID')
+        self.assertEqual([sorted(record) for record in records], [['ID', 'YR']] * len(records))
+
+    def test_bad_requests(self):
+        self.assertEqual(self.status('/records?limit=abc'), 400)
+        self.assertEqual(self.status('/records?box=1,2,3'), 400)
+        self.assertEqual(self.status('/records?start=yesterday'), 400)
+        self.assertEqual(self.status('/nowhere'), 404)
+
+    def test_stats(self):
+        self.records(start='1850-01-10', end='1850-01-20')
+        first = self.get('/stats')
+        self.assertEqual(first['hits'], 0)
+        self.assertGreater(first['misses'], 0)
+        self.records(start='1850-01-10', end='1850-01-20')
+        second = self.get('/stats')
+        self.assertEqual(second['misses'], first['misses'])
+        self.assertEqual(second['hits'], first['misses'])
+        self.assertEqual(second['records'], first['records'])
+
+    def test_files(self):
+        self.assertEqual(self.get('/files'), [{'file': self.filename, 'records': 100, 'blocks': 10}])
+
+    @unittest.skipIf(not hasattr(socket, 'AF_UNIX'), 'no Unix sockets')
+    def test_unix_socket(self):
+        path = os.path.join(self.directory, 'imma.sock')
+        server = UnixQueryServer(self.fileset, path, workers=2, limit=1000)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            connection = UnixConnection(path)
+            connection.request('GET', '/records?id=LIBERTY')
+            response = connection.getresponse()
+            self.assertEqual(response.status, 200)
+            records = json.loads(response.read().decode('utf-8'))['records']
+            connection.close()
+            self.assertEqual(records, self.records(id='LIBERTY'))
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
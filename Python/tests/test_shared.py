@@ -0,0 +1,67 @@
+# Tests of handing columns between processes through shared memory
+#
+# Usage: python -m pytest tests (or python -m unittest discover tests)
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import IMMA
+from IMMA.shared import parallel_columns
+from IMMA.synthetic import generate
+
+SHM = '/dev/shm'
+
+
+@unittest.skipIf(not os.path.isdir(SHM), 'no /dev/shm to check for segments')
+class TestParallelColumns(unittest.TestCase):
+
+    params = ['YR', 'SST', 'DCK', 'ID']
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'synthetic.imma')
+        with open(self.filename, 'w') as fh:
+            generate(fh, 2000, (0, 1, 99), seed=1)
+        self.before = set(os.listdir(SHM))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def leaked(self):
+        return set(os.listdir(SHM)) - self.before
+
+    def test_values(self):
+        with IMMA.open_file(self.filename) as fh:
+            expected = IMMA.columns(fh, self.params)
+        for filename, shared in parallel_columns([self.filename] * 3, self.params, processes=2):
+            self.assertEqual(len(shared), 2000)
+            for p in ('YR', 'SST', 'DCK'):
+                self.assertEqual(shared.values(p), expected[p])
+            self.assertEqual([v.strip() if v else v for v in shared.values('ID')],
+                             [v.strip() if v else v for v in expected['ID']])
+        self.assertEqual(self.leaked(), set())
+
+    def test_break_is_quick(self):
+        # Stopping after the first file doesn't wait for the rest to be decoded
+        files = [self.filename] * 200
+        start = time.time()
+        for filename, shared in parallel_columns(files, self.params, processes=2):
+            break
+        self.assertLess(time.time() - start, 5)
+        self.assertEqual(self.leaked(), set())
+
+    def test_exception(self):
+        with self.assertRaises(ValueError):
+            for filename, shared in parallel_columns([self.filename] * 6, self.params, processes=2):
+                raise ValueError()
+        self.assertEqual(self.leaked(), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+# Tests of the single-pass statistics: the quantile sketch, and merging
+#
+# Usage: python -m pytest tests (or python -m unittest discover tests)
+
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import IMMA
+from IMMA.dataset import IMMADataset
+from IMMA.stats import ParameterStats, QuantileSketch, StatsCollector
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', 'R', 'IMMA', 'inst', 'extdata', 'tests')
+
+
+def corpus_lines(name):
+    with open(os.path.join(CORPUS, name), encoding='latin-1') as fh:
+        return [line for line in fh if len(line.strip()) > 0]
+
+
+class TestSketch(unittest.TestCase):
+
+    def test_quantiles(self):
+        # Rank error well within 2% for 100,000 values
+        rng = random.Random(1)
+        values = [rng.random() for i in range(100000)]
+        sketch = QuantileSketch(k=200, seed=1)
+        for value in values:
+            sketch.add(value)
+        self.assertEqual(sketch.count(), len(values))
+        self.assertLess(sum(len(level) for level in sketch.levels), 5000)
+        ordered = sorted(values)
+        probabilities = (0.01, 0.25, 0.5, 0.75, 0.99)
+        for probability, quantile in zip(probabilities, sketch.quantiles(probabilities)):
+            rank = ordered.index(quantile) / len(ordered)
+            self.assertAlmostEqual(rank, probability, delta=0.02)
+
+    def test_merge(self):
+        rng = random.Random(2)
+        sketches = [QuantileSketch(k=100, seed=i) for i in range(4)]
+        values = []
+        for i, sketch in enumerate(sketches):
+            for j in range(10000):
+                value = rng.gauss(i, 1)
+                values.append(value)
+                sketch.add(value)
+        for sketch in sketches[1:]:
+            sketches[0].merge(sketch)
+        self.assertEqual(sketches[0].count(), len(values))
+        median = sketches[0].quantiles([0.5])[0]
+        self.assertAlmostEqual(sorted(values).index(median) / len(values), 0.5, delta=0.02)
+
+    def test_empty(self):
+        self.assertEqual(QuantileSketch().quantiles([0.5]), [None])
+
+
+class TestWelford(unittest.TestCase):
+
+    def test_merge_matches_one_pass(self):
+        rng = random.Random(3)
+        parts = [[rng.gauss(100 * i, 10 + i) for j in range(n)] for i, n in enumerate((1, 50, 1000, 7))]
+        merged = ParameterStats('SST')
+        for part in parts:
+            stats = ParameterStats('SST')
+            for value in part:
+                stats.add(value)
+            merged.merge(stats)
+        values = [value for part in parts for value in part]
+        result = merged.result()
+        self.assertEqual(result['count'], len(values))
+        self.assertAlmostEqual(result['mean'], statistics.mean(values), places=9)
+        self.assertAlmostEqual(result['variance'] / statistics.variance(values), 1.0, places=12)
+        self.assertEqual((result['min'], result['max']), (min(values), max(values)))
+
+
+class TestCollector(unittest.TestCase):
+
+    params = ['SST', 'AT', 'WW', 'ID', 'ATTE']
+
+    def test_merge_matches_one_pass(self):
+        lines = corpus_lines('basic.imma') + corpus_lines('mixed_attachments.imma')
+        whole = StatsCollector(self.params)
+        for record in IMMA.records(lines):
+            whole.add(record)
+        for params in (self.params, None):
+            merged = StatsCollector(params)
+            for start in range(0, len(lines), 30):
+                part = StatsCollector(params)
+                for record in IMMA.records(lines[start:start + 30]):
+                    part.add(record)
+                merged.merge(part)
+            for p in self.params:
+                expected, result = whole.result()[p], merged.result()[p]
+                for name in ('count', 'missing', 'min', 'max', 'histogram'):
+                    self.assertEqual(result.get(name), expected.get(name), (p, name))
+                if expected['mean'] is not None:
+                    self.assertAlmostEqual(result['mean'], expected['mean'])
+            self.assertEqual(merged.records, len(lines))
+
+    def test_columns_match_records(self):
+        lines = corpus_lines('mixed_attachments.imma')
+        by_records = StatsCollector(self.params)
+        for record in IMMA.records(lines):
+            by_records.add(record)
+        by_columns = StatsCollector(self.params)
+        by_columns.add_columns(IMMA.columns(lines, ['SST', 'AT']))  # WW, ID and ATTE left out
+        self.assertEqual(by_columns.records, len(lines))
+        for p in self.params:
+            self.assertEqual(by_columns.stats[p].count + by_columns.stats[p].missing, len(lines), p)
+        for p in ('SST', 'AT'):
+            self.assertEqual(by_columns.result()[p], by_records.result()[p])
+
+
+class TestDatasetStats(unittest.TestCase):
+
+    def test_matches_collector(self):
+        directory = tempfile.mkdtemp()
+        try:
+            lines = corpus_lines('basic.imma')
+            for month, part in ((1, lines[:40]), (2, lines[40:])):
+                with open(os.path.join(directory, 'IMMA1_R3.0.0_1850-%02d' % month), 'w',
+                          encoding='latin-1') as fh:
+                    fh.write(''.join(part))
+            result = IMMADataset(directory).stats(['SST', 'YR'], processes=1).result()
+            expected = StatsCollector(['SST', 'YR'])
+            for record in IMMA.records(lines):
+                expected.add(record)
+            for p in ('SST', 'YR'):
+                for name in ('count', 'missing', 'min', 'max'):
+                    self.assertEqual(result[p][name], expected.result()[p][name])
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
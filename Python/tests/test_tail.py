@@ -0,0 +1,98 @@
+# Tests of reading growing files: partial lines, truncation and rotation
+#
+# Usage: python -m pytest tests (or python -m unittest discover tests)
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import IMMA
+from IMMA.tail import TailReader
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', 'R', 'IMMA', 'inst', 'extdata', 'tests')
+
+
+class TestTail(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.feed = os.path.join(self.directory, 'feed')
+        os.mkdir(self.feed)
+        self.filename = os.path.join(self.feed, 'a.imma')
+        self.checkpoint = os.path.join(self.directory, 'checkpoint')
+        with open(os.path.join(CORPUS, 'basic.imma'), encoding='latin-1') as fh:
+            self.lines = [line for line in fh if len(line.strip()) > 0]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def reader(self):
+        return TailReader([self.feed], checkpoint=self.checkpoint, pattern='*.imma')
+
+    def write(self, text, mode='a', filename=None):
+        with open(filename or self.filename, mode, encoding='latin-1') as fh:
+            fh.write(text)
+
+    def values(self, result):
+        return [record.data for filename, record in result]
+
+    def expected(self, lines):
+        return [IMMA.read(line).data for line in lines]
+
+    def test_partial_line_resumed(self):
+        reader = self.reader()
+        line = self.lines[1]
+        self.write(self.lines[0] + line[:100])
+        self.assertEqual(len(reader.poll()), 1)
+        reader.save()
+        self.write(line[100:])
+        reader = self.reader()  # From the checkpoint
+        result = reader.poll()
+        self.assertEqual(self.values(result), self.expected([line]))
+        self.assertEqual(reader.poll(), [])
+
+    def test_truncated(self):
+        reader = self.reader()
+        self.write(''.join(self.lines[:5]))
+        self.assertEqual(len(reader.poll()), 5)
+        self.write(''.join(self.lines[5:7]), 'w')
+        self.assertEqual(self.values(reader.poll()), self.expected(self.lines[5:7]))
+
+    def test_rewritten_to_same_size(self):
+        # Truncated and written again to the old size before the next poll (copytruncate)
+        reader = self.reader()
+        self.write(''.join(self.lines[:5]))
+        self.assertEqual(len(reader.poll()), 5)
+        reader.save()
+        self.write(''.join(self.lines[10:15]), 'w')
+        self.assertEqual(os.path.getsize(self.filename), sum(len(line) for line in self.lines[:5]))
+        reader = self.reader()
+        self.assertEqual(self.values(reader.poll()), self.expected(self.lines[10:15]))
+
+    def test_rotated(self):
+        reader = self.reader()
+        self.write(''.join(self.lines[:3]))
+        self.assertEqual(len(reader.poll()), 3)
+        # More is written, the file is renamed, and a new one started
+        self.write(''.join(self.lines[3:5]) + self.lines[5].rstrip('\n'))
+        rotated = self.filename + '.1'
+        os.rename(self.filename, rotated)
+        self.write(''.join(self.lines[6:8]))
+        result = reader.poll()
+        self.assertEqual(len(result), 5)
+        by_file = dict((filename, [record.data for name, record in result if name == filename])
+                       for filename in (rotated, self.filename))
+        self.assertEqual(by_file[rotated], self.expected(self.lines[3:6]))
+        self.assertEqual(by_file[self.filename], self.expected(self.lines[6:8]))
+        # The rotated file has been read to its end, so is no longer followed
+        self.assertEqual(list(reader.state), [self.filename])
+        self.assertEqual(reader.poll(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
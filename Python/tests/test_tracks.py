@@ -0,0 +1,114 @@
+# Tests of the ship tracks: the numpy and pure-Python leg checks agree,
+#  and the index finds the same reports as decoding every record
+#
+# Usage: python -m pytest tests (or python -m unittest discover tests)
+
+import math
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import IMMA
+from IMMA import tracks
+from IMMA.tracks import Track, TrackIndex, great_circle
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', 'R', 'IMMA', 'inst', 'extdata', 'tests')
+
+
+def random_track(n, seed):
+    # Reports with repeated times and positions, some known only to the day
+    rng = random.Random(seed)
+    reports = []
+    time, lat, lon = 0.0, rng.uniform(-60, 60), rng.uniform(0, 360)
+    for i in range(n):
+        if rng.random() > 0.1:
+            time += rng.choice([0.0, 1.0, 6.0, 24.0])
+        if rng.random() > 0.1:
+            lat = max(-89.0, min(89.0, lat + rng.uniform(-3, 3)))
+            lon = (lon + rng.uniform(-3, 3)) % 360.0
+        reports.append((time, lat, lon, (0, i), rng.random() > 0.3))
+    return Track(('SHIP', None, None), reports)
+
+
+def pure_python(function, *args):
+    numpy, tracks.numpy = tracks.numpy, None
+    try:
+        return function(*args)
+    finally:
+        tracks.numpy = numpy
+
+
+@unittest.skipIf(tracks.numpy is None, 'numpy is not installed')
+class TestNumpyMatchesPython(unittest.TestCase):
+
+    def assertClose(self, first, second, name):
+        self.assertEqual(len(first), len(second), name)
+        for x, y in zip(first, second):
+            if math.isinf(y):
+                self.assertEqual(x, y, name)
+            else:
+                self.assertAlmostEqual(x, y, delta=1e-9 * max(1.0, abs(y)), msg=name)
+
+    def test_great_circle(self):
+        rng = random.Random(1)
+        points = [[rng.uniform(-90, 90) if i % 2 == 0 else rng.uniform(-180, 360) for j in range(500)]
+                  for i in range(4)]
+        for name, vector, scalar in zip(('distances', 'headings'), great_circle(*points),
+                                        pure_python(great_circle, *points)):
+            self.assertClose(vector, scalar, name)
+
+    def test_legs(self):
+        for seed in range(5):
+            track = random_track(300, seed)
+            for name, vector, scalar in zip(('distances', 'durations', 'speeds', 'headings'),
+                                            track.legs(), pure_python(track.legs)):
+                self.assertClose(vector, scalar, name)
+
+    def test_check(self):
+        for seed in range(5):
+            track = random_track(300, seed)
+            for max_speed, max_turn in ((40.0, None), (10.0, 90.0), (1.0, 30.0)):
+                flags = track.check(max_speed, max_turn)
+                self.assertEqual(list(flags), list(pure_python(track.check, max_speed, max_turn)))
+                self.assertEqual(len(flags), len(track) - 1)
+
+    def test_short_tracks(self):
+        for n in (0, 1, 2):
+            track = random_track(n, n)
+            self.assertEqual([list(a) for a in track.legs()], [list(a) for a in pure_python(track.legs)])
+            self.assertEqual(list(track.check(max_turn=45.0)),
+                             list(pure_python(track.check, 40.0, 45.0)))
+
+
+class TestIndex(unittest.TestCase):
+
+    def test_matches_decoding(self):
+        files = [os.path.join(CORPUS, name) for name in ('basic.imma', 'mixed_attachments.imma')]
+        index = TrackIndex(files)
+        keys = set()
+        for filename in files:
+            with open(filename, encoding='latin-1') as fh:
+                for line in fh:
+                    key = tracks.track_key(IMMA.read(line))
+                    if key is not None:
+                        keys.add(key)
+        self.assertEqual(set(index.locations), keys)
+        for id in index.ids():
+            for track in index.tracks(id):
+                for location, time, lat, lon in zip(track.locations, track.time, track.lat, track.lon):
+                    record = dict(index.records(track.key))[location]
+                    self.assertEqual((time, lat, lon),
+                                     (tracks.record_time(record), record['LAT'], record['LON']))
+
+    def test_undecodable_lines_counted(self):
+        filename = os.path.join(CORPUS, 'IMMA1_0+1+5+6+7+8+9+98+99.imma')
+        index = TrackIndex([filename])
+        self.assertEqual(index.errors, {filename: 4})
+
+
+if __name__ == '__main__':
+    unittest.main()